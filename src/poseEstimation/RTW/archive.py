@@ -0,0 +1,145 @@
+import os
+import re
+import glob
+import argparse
+import numpy as np
+from multiprocessing import Pool, cpu_count
+
+'''
+    A frame archive holds the text frames of one ITOP person
+    (<person>_<frame>_<stream>.txt) in binary form, in the directory
+    <archive dir>/<person>. Every stream is one .npy file with a row per
+    frame, and frames.npy is the index: the sorted frame numbers of the rows.
+    The files are opened through mmap, so any frame or range of frames is
+    read without parsing or loading the rest.
+'''
+H = 240
+W = 320
+streams = ['depth_side', 'depth_top', 'joints_side', 'joints_top', \
+           'label_side', 'label_top']
+dtypes = {'depth': np.float64, 'joints': np.float64, 'label': np.int16}
+
+def getPersonDir(archiveDir, person):
+    return archiveDir+'/'+str(person).zfill(2)
+
+'''
+    The function returns the sorted frame numbers of the frames of a person
+    in dataDir that have all their stream files, and the paths of their
+    files (a list of len(streams) paths per frame).
+'''
+def getFrameFiles(dataDir, person):
+    prefix = dataDir+'/'+str(person).zfill(2)+'_'
+    files = {}
+    for path in glob.glob(prefix+'[0-9]'*5+'_*.txt'):
+        frame, stream = re.match(r'(\d{5})_(.*)\.txt$', \
+                                 path[len(prefix):]).groups()
+        if stream in streams:
+            files.setdefault(int(frame), {})[stream] = path
+
+    frames = sorted([frame for frame in files.keys() \
+                     if len(files[frame]) == len(streams)])
+    return (frames, [[files[frame][stream] for stream in streams] \
+                     for frame in frames])
+
+def parseStream(path, stream):
+    with open(path) as f:
+        text = f.read()
+    if stream.startswith('joints'):
+        return np.fromstring(text.replace(',', ' '), sep=' ').reshape(-1, 5)
+    return np.fromstring(text, sep=' ').reshape(H, W)
+
+'''
+    The function adds the frames of a person in dataDir that are not in the
+    archive of the person yet. The archive is rewritten with its old rows
+    copied and the new frames parsed, and the index is replaced last, so an
+    interrupted conversion leaves the old archive intact. It returns the
+    person, the number of frames in the archive and the number of frames
+    converted now.
+'''
+def convertPerson(args):
+    dataDir, archiveDir, person = args
+    personDir = getPersonDir(archiveDir, person)
+    if not os.path.exists(personDir):
+        os.makedirs(personDir)
+
+    frames, files = getFrameFiles(dataDir, person)
+    oldFrames, old = loadArchive(archiveDir, person)
+    parsed = {}
+    for frame, paths, row in zip(frames, files, findFrames(oldFrames, frames)):
+        if row != -1:
+            continue
+        try:
+            parsed[frame] = [parseStream(path, stream) \
+                             for path, stream in zip(paths, streams)]
+        except ValueError:
+            print 'cannot parse frame %d of person %d' % (frame, person)
+    if len(parsed) == 0:
+        return (person, oldFrames.shape[0], 0)
+
+    frames = np.union1d(oldFrames, parsed.keys()).astype(int)
+    rows = findFrames(oldFrames, frames)
+    nJoints = parsed.values()[0][2].shape[0]
+    for s, stream in enumerate(streams):
+        shape = (nJoints, 5) if stream.startswith('joints') else (H, W)
+        arr = np.lib.format.open_memmap(personDir+'/'+stream+'.tmp.npy', \
+            mode='w+', dtype=dtypes[stream.split('_')[0]], \
+            shape=(frames.shape[0],)+shape)
+        for k, frame in enumerate(frames):
+            arr[k] = old[stream][rows[k]] if rows[k] != -1 \
+                else parsed[frame][s]
+        del arr
+
+    for stream in streams:
+        os.rename(personDir+'/'+stream+'.tmp.npy', personDir+'/'+stream+'.npy')
+    np.save(personDir+'/frames.tmp.npy', frames)
+    os.rename(personDir+'/frames.tmp.npy', personDir+'/frames.npy')
+
+    return (person, frames.shape[0], len(parsed))
+
+'''
+    The function returns the index of the archive of a person and its
+    streams, as a dict of memory maps (empty when there is no archive).
+'''
+def loadArchive(archiveDir, person):
+    personDir = getPersonDir(archiveDir, person)
+    if not os.path.isfile(personDir+'/frames.npy'):
+        return (np.zeros(0, int), {})
+    return (np.load(personDir+'/frames.npy'), \
+            dict([(stream, np.load(personDir+'/'+stream+'.npy', mmap_mode='r')) \
+                  for stream in streams]))
+
+'''
+    The function returns the rows of frames in an archive with the index
+    index, -1 for the frames it does not hold.
+'''
+def findFrames(index, frames):
+    frames = np.asarray(frames, int)
+    if index.shape[0] == 0:
+        return -np.ones(frames.shape, int)
+    rows = np.minimum(np.searchsorted(index, frames), index.shape[0]-1)
+    return np.where(index[rows] == frames, rows, -1)
+
+'''
+    The function converts the text frames of the people of dataDir to their
+    archives in archiveDir, one person per task of a pool of nWorkers
+    processes. Frames already in an archive are not parsed again.
+'''
+def main(**kwargs):
+    dataDir, archiveDir = kwargs.get('indir'), kwargs.get('outdir')
+    people = range(kwargs.get('people'))
+
+    pool = Pool(kwargs.get('nworkers'))
+    for person, n, nNew in pool.imap_unordered(convertPerson, \
+            [(dataDir, archiveDir, person) for person in people]):
+        print 'person %d: %d frames, %d converted' % (person, n, nNew)
+    pool.close()
+    pool.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--indir', required=True)
+    parser.add_argument('--outdir', required=True)
+    parser.add_argument('--people', type=int, default=20)
+    parser.add_argument('--nworkers', type=int, default=cpu_count())
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,105 @@
+import numpy as np
+
+'''
+    The function samples points along the bones of N skeletons in one pass.
+    joints is N x J x 3 and bones a list of B (first, second) joint index
+    pairs. Every bone is sampled like np.arange(start, end, (end-start)/
+    ptsPerBone) along x or y, whichever it spans more, from its lower to its
+    upper end, and the two other coordinates are interpolated linearly (and
+    rounded when rounded is True). A bone whose ends coincide gets no
+    samples.
+
+    The samples of bone b take the labels labels[b] (bones[b] by default):
+    the weights[b] share (0.5 by default) of them that is closest to the
+    first joint gets the first label and the rest get the second one.
+
+    It returns the N x B*(ptsPerBone+1) x 3 points and the N x
+    B*(ptsPerBone+1) labels, ordered by bone and then along the bone, where
+    the padding has label -1. pts[i][labels[i] >= 0] are the samples of
+    skeleton i.
+'''
+def sampleSkeleton(joints, bones, ptsPerBone, weights=None, labels=None, \
+                   rounded=False):
+    N, B, P = joints.shape[0], len(bones), int(ptsPerBone)+1
+    bones = np.asarray(bones)
+    labels = bones if labels is None else np.asarray(labels)
+    weights = 0.5*np.ones(B) if weights is None else np.asarray(weights)
+
+    pt1 = joints[:, bones[:, 0]] # N x B x 3
+    pt2 = joints[:, bones[:, 1]]
+    diff = np.abs(pt1-pt2)
+    axis = (diff[:, :, 0] < diff[:, :, 1]).astype(int)
+    a1 = np.where(axis == 1, pt1[:, :, 1], pt1[:, :, 0])
+    a2 = np.where(axis == 1, pt2[:, :, 1], pt2[:, :, 0])
+    start = np.minimum(a1, a2)
+    end = np.maximum(a1, a2)
+
+    # np.arange takes ceil((end-start)/step) values start+i*delta, where
+    # delta = (start+step)-start
+    step = (end-start)/ptsPerBone
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nPts = np.where(step > 0, np.ceil((end-start)/step), 0).astype(int)
+        delta = (start+step)-start
+        t = start[:, :, np.newaxis] + np.arange(P)*delta[:, :, np.newaxis]
+
+        pts = (t-a1[:, :, np.newaxis])/(a2-a1)[:, :, np.newaxis]
+        pts = pts[:, :, :, np.newaxis]*(pt2-pt1)[:, :, np.newaxis] + \
+            pt1[:, :, np.newaxis]
+    if rounded:
+        pts = np.round(pts)
+    pts[:, :, :, 0] = np.where(axis[:, :, np.newaxis] == 0, t, pts[:, :, :, 0])
+    pts[:, :, :, 1] = np.where(axis[:, :, np.newaxis] == 1, t, pts[:, :, :, 1])
+
+    n1 = (weights*nPts).astype(int)
+    nLow = np.where(a1 <= a2, n1, nPts-n1)
+    low = np.where(a1 <= a2, labels[:, 0], labels[:, 1])
+    high = np.where(a1 >= a2, labels[:, 0], labels[:, 1])
+    k = np.arange(P)
+    ptLabels = np.where(k < nLow[:, :, np.newaxis], low[:, :, np.newaxis], \
+                        high[:, :, np.newaxis])
+    ptLabels[k >= nPts[:, :, np.newaxis]] = -1
+    pts[ptLabels == -1] = 0
+
+    return (pts.reshape(N, B*P, 3), ptLabels.reshape(N, B*P))
+
+'''
+    The function splits every bone of N skeletons (joints is N x J x 3) at
+    its weights share (0.5 by default) from the first joint, where the
+    sampled labels change in sampleSkeleton. It returns the N x 2B x 3 start
+    and end points of the resulting segments and their 2B labels.
+'''
+def getSegments(joints, bones, weights=None, labels=None):
+    B = len(bones)
+    bones = np.asarray(bones)
+    labels = bones if labels is None else np.asarray(labels)
+    weights = 0.5*np.ones(B) if weights is None else np.asarray(weights)
+
+    pt1 = joints[:, bones[:, 0]]
+    pt2 = joints[:, bones[:, 1]]
+    mid = pt1*(1-weights[:, np.newaxis]) + pt2*weights[:, np.newaxis]
+
+    return (np.concatenate((pt1, mid), axis=1), \
+            np.concatenate((mid, pt2), axis=1), \
+            np.concatenate((labels[:, 0], labels[:, 1])))
+
+'''
+    The function returns the index of the segment (seg1[i, s] to seg2[i, s])
+    nearest to every point of pts (M x 3), where i is the frame of the point
+    (frames, 0 for all points by default), by exact point to segment
+    distances. The distances are computed for chunk points at a time.
+'''
+def nearestSegment(pts, seg1, seg2, frames=None, chunk=4096):
+    if frames is None:
+        frames = np.zeros(pts.shape[0], int)
+    d = seg2-seg1
+    len2 = np.sum(d**2, axis=2)
+    len2[len2 == 0] = np.inf # a point segment is nearest at its start
+
+    nearest = np.empty(pts.shape[0], int)
+    for k in range(0, pts.shape[0], chunk):
+        p = pts[k:k+chunk, np.newaxis] - seg1[frames[k:k+chunk]] # M x S x 3
+        t = np.sum(p*d[frames[k:k+chunk]], axis=2)/len2[frames[k:k+chunk]]
+        p -= np.clip(t, 0, 1)[:, :, np.newaxis]*d[frames[k:k+chunk]]
+        nearest[k:k+chunk] = np.argmin(np.sum(p**2, axis=2), axis=1)
+
+    return nearest
@@ -0,0 +1,60 @@
+import os
+import json
+import hashlib
+import tempfile
+
+'''
+    Every expensive stage of a run (data loading, the samples and the model
+    of each joint, the test walks) writes a small manifest <stage>.json next
+    to its outputs. It holds the key of the inputs and parameters the stage
+    was computed from, the parameters themselves and whether the stage
+    finished. A finished stage with an unchanged key is skipped; any other
+    stage is recomputed. Stages chain by putting the key of the stage they
+    read from in their parameters.
+'''
+def getKey(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+'''
+    The function returns the path, size and modification time of every file
+    of paths, to stand for the content of the input files of a stage.
+'''
+def fileStamps(paths):
+    return [[path, os.path.getsize(path), os.path.getmtime(path)] \
+            for path in sorted(paths)]
+
+'''
+    The function returns the SHA-1 of the content of a file, for the small
+    inputs of a stage that are drawn again with the same path and size.
+'''
+def fileHash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def readStage(dir, stage):
+    path = dir+'/'+stage+'.json'
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+'''
+    The function writes the manifest of a stage through a temporary file of
+    its own, so that processes writing the same stage at once never mix
+    their files. A finished stage is not rewritten when its manifest already
+    records it as finished with the same key.
+'''
+def writeStage(dir, stage, key, params, done):
+    path = dir+'/'+stage+'.json'
+    if done and isDone(dir, stage, key):
+        return
+    fd, tmpPath = tempfile.mkstemp(prefix=stage+'.', suffix='.tmp', dir=dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'key': key, 'done': done, 'params': params}, f, \
+                  indent=1, sort_keys=True)
+    os.rename(tmpPath, path)
+
+def isDone(dir, stage, key):
+    manifest = readStage(dir, stage)
+    return manifest is not None and manifest['key'] == key and \
+        manifest['done']
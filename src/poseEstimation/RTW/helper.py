@@ -4,6 +4,8 @@ import cv2
 import os
 import logging
 import os.path
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from sklearn.neighbors import KNeighborsClassifier
 
 np.set_printoptions(threshold=np.nan)
@@ -12,11 +14,6 @@ logger.setLevel(logging.DEBUG)
 
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-fh = logging.FileHandler('log.txt')
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(formatter)
-logger.addHandler(fh)
-
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 ch.setFormatter(formatter)
@@ -55,49 +52,88 @@ def mkdir(dir):
             raise
         pass
 
-def getImgsAndJointsITOP(dataDir, nJoints, isTop=False, maxN=None):
+'''
+    The function logs to log.txt in dir from now on, as well as to the
+    console. It replaces the log file of an earlier call.
+'''
+def setLogFile(dir):
+    mkdir(dir)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+
+    fh = logging.FileHandler(os.path.join(dir, 'log.txt'))
+    fh.setLevel(logging.DEBUG)
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+'''
+    The function loads the ITOP depth images (in meters, with the background
+    set to 0) and joints of the train and test people. The file headers are
+    read first so that the train and test stacks are allocated once, or
+    created as .npy memory maps at outPrefix+'I_train.npy' and
+    outPrefix+'I_test.npy' when outPrefix is given, and every person is then
+    decoded straight into its slice by a pool of nWorkers threads. trainTest
+    marks the people of dataDir as train (0) or test (1) and defaults to
+    trainTestITOP.
+'''
+def getImgsAndJointsITOP(dataDir, nJoints, isTop=False, maxN=None, \
+                         outPrefix=None, nWorkers=cpu_count(), trainTest=None):
     global trainTestITOP
-    I_train, I_test = np.empty((0, H, W), np.float16), \
-        np.empty((0, H, W), np.float16)
-    joints_train, joints_test = np.empty((0, nJoints, 3)), \
-        np.empty((0, nJoints, 3))
 
     if maxN is not None:
         trainTestITOP = [1, 0]
+    if trainTest is None:
+        trainTest = trainTestITOP
 
     fileName = 'top.npy' if isTop else 'side.npy'
-    for i, isTest in enumerate(trainTestITOP):
-        depthPath = dataDir + '/' + str(i).zfill(2) + '_depth_' + fileName
-        jointsPath = dataDir + '/' + str(i).zfill(2) + '_joints_' + fileName
-        maskPath = dataDir + '/' + str(i).zfill(2) + '_predicts_' + fileName
-        logger.debug('loading %s', depthPath)
-        I = np.load(depthPath)
-        joints = np.load(jointsPath)[:, :, :3]
-        #print type(depthPath[0,0,0])
-        I /= 1000.0
-        joints[:, :, 2] /= 1000.0
-        mask = np.load(maskPath)
-        mask[mask >= 0] = 1
-        mask[mask == -1] = 0
-        I *= mask
-
-        if isTest == 0:
-            I_train = np.append(I_train, I, axis=0).astype('float16')
-            joints_train = np.append(joints_train, joints, axis=0)
+    caps = [None, None] if maxN is None else [maxN, maxN/10] # train, test
+    sizes = [0, 0]
+    people = []
+    for i, isTest in enumerate(trainTest):
+        prefix = dataDir + '/' + str(i).zfill(2)
+        depthPath = prefix + '_depth_' + fileName
+        n = np.load(depthPath, mmap_mode='r').shape[0]
+        if caps[isTest] is not None:
+            n = max(0, min(n, caps[isTest]-sizes[isTest]))
+        people.append((depthPath, prefix + '_joints_' + fileName, \
+                       prefix + '_predicts_' + fileName, isTest, \
+                       sizes[isTest], n))
+        sizes[isTest] += n
+
+    I, joints = [None, None], [None, None]
+    for isTest, name in enumerate(['I_train.npy', 'I_test.npy']):
+        if outPrefix is None:
+            I[isTest] = np.empty((sizes[isTest], H, W), np.float16)
         else:
-            I_test = np.append(I_test, I, axis=0).astype('float16')
-            joints_test = np.append(joints_test, joints, axis=0)
-
-    if maxN is not None:
-        I_train = I_train[:maxN]
-        I_test = I_test[:(maxN/10)]
-        joints_train = joints_train[:maxN]
-        joints_test = joints_test[:(maxN/10)]
-
-    assert I_train.shape[0] == joints_train.shape[0]
-    assert I_test.shape[0] == joints_test.shape[0]
+            I[isTest] = np.lib.format.open_memmap(outPrefix+name, mode='w+', \
+                dtype=np.float16, shape=(sizes[isTest], H, W))
+        joints[isTest] = np.empty((sizes[isTest], nJoints, 3))
 
-    return (I_train, I_test, joints_train, joints_test)
+    def loadPerson(person):
+        depthPath, jointsPath, maskPath, isTest, start, n = person
+        logger.debug('loading %s', depthPath)
+        depth = np.load(depthPath, mmap_mode='r')
+        mask = np.load(maskPath, mmap_mode='r')
+        for k in range(0, n, 100):
+            chunk = depth[k:min(k+100, n)].astype(np.float32)
+            chunk /= 1000.0
+            chunk[mask[k:min(k+100, n)] < 0] = 0
+            I[isTest][start+k:start+k+chunk.shape[0]] = chunk
+        joints[isTest][start:start+n] = np.load(jointsPath)[:n, :, :3]
+        joints[isTest][start:start+n, :, 2] /= 1000.0
+
+    pool = ThreadPool(nWorkers)
+    pool.map(loadPerson, [p for p in people if p[5] > 0])
+    pool.close()
+    pool.join()
+
+    if outPrefix is not None:
+        I[0].flush()
+        I[1].flush()
+
+    return (I[0], I[1], joints[0], joints[1])
 
 def perPixelLabels(I, joints, nJoints):
     '''
@@ -171,6 +207,7 @@ def drawPred(img, joints, paths, center, filename, nJoints, jointName, isTop):
     img = cv2.applyColorMap(img, cv2.COLORMAP_OCEAN)
     img = np.hstack((img, np.zeros((H, 100, 3)))).astype(np.uint8)
 
+    # paths may be the int16 rows of a paths store
     if paths is not None:
         paths_copy = paths.copy()
         if isTop:
@@ -201,6 +238,22 @@ def drawPred(img, joints, paths, center, filename, nJoints, jointName, isTop):
 
     cv2.imwrite(filename, img)
 
+'''
+    The paths of the test walks are stored as an nFrames x nJoints x nKept x 3
+    int16 .npy memory map, keeping every stride-th position of the walks
+    with the pixel coordinates rounded and the depth in millimeters.
+'''
+def openPaths(path, nFrames, nJoints, nSteps, stride):
+    nKept = len(range(0, nSteps+1, stride))
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.int16, \
+                                     shape=(nFrames, nJoints, nKept, 3))
+
+def encodePaths(qm):
+    return np.rint(qm*[1, 1, 1000]).astype(np.int16)
+
+def decodePaths(paths):
+    return paths*np.array([1, 1, 1e-3])
+
 def checkUnitVectors(unitVectors):
     s1 = np.sum(unitVectors.astype(np.float32)**2)
     s2 = unitVectors.shape[0]
@@ -263,7 +316,7 @@ def main():
         joint = np.load('visualize/joint'+str(idx)+'.npy')
         img = np.load('visualize/img'+str(idx)+'.npy')
     else:
-        qms = np.load('models_ITOP_'+view+'/qms.npy')
+        paths = np.load('models_ITOP_'+view+'/paths.npy', mmap_mode='r')
         joints = np.load('models_ITOP_'+view+'/joints_pred.npy')
         #I = np.load('data_ITOP_side/I_test.npy')
         i = 0
@@ -278,7 +331,7 @@ def main():
 
         if not os.path.isdir('visualize'):
             os.makedirs('visualize')
-        qm = qms[idx]
+        qm = decodePaths(paths[idx])
         joint = joints[idx, :, :2]
         img = I[idx-offset]
         np.save('visualize/qm'+str(idx)+'.npy', qm)
@@ -0,0 +1,68 @@
+import json
+import struct
+import numpy as np
+
+'''
+    A model file is a versioned container of named arrays that is opened
+    through mmap, so that loading it costs no unpickling and processes that
+    open the same file share its pages. The layout is
+
+        magic (8 bytes) | header length (uint32) | JSON header | arrays
+
+    where the header holds the format version, the manifest (free-form
+    metadata such as joint names) and the dtype, shape and offset of every
+    array. Every array starts on an ALIGN-byte boundary.
+'''
+MAGIC = 'HCMODEL\0'
+VERSION = 1
+ALIGN = 64
+
+def saveArrays(path, arrays, manifest):
+    entries = {}
+    offset = 0
+    for name in sorted(arrays.keys()):
+        arr = np.ascontiguousarray(arrays[name])
+        entries[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), \
+                         'offset': offset}
+        offset += (arr.nbytes+ALIGN-1)//ALIGN*ALIGN
+
+    header = json.dumps({'version': VERSION, 'manifest': manifest, \
+                         'arrays': entries})
+    start = (len(MAGIC)+4+len(header)+ALIGN-1)//ALIGN*ALIGN
+    header += ' '*(start-len(MAGIC)-4-len(header))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name in sorted(arrays.keys()):
+            arr = np.ascontiguousarray(arrays[name])
+            f.seek(start+entries[name]['offset'])
+            f.write(arr.tobytes())
+        f.truncate(start+offset)
+
+'''
+    The function opens a model file and returns its arrays, as read-only
+    views of one memory map, and its manifest.
+'''
+def loadArrays(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a model file' % path)
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    if header['version'] != VERSION:
+        raise ValueError('%s: unsupported model file version %d' % \
+                         (path, header['version']))
+
+    start = len(MAGIC)+4+length
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(str(entry['dtype']))
+        shape = tuple(entry['shape'])
+        nbytes = dtype.itemsize*int(np.prod(shape))
+        offset = start+entry['offset']
+        arrays[str(name)] = buf[offset:offset+nbytes].view(dtype).reshape(shape)
+
+    return (arrays, header['manifest'])
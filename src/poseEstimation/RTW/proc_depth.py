@@ -1,15 +1,19 @@
 import numpy as np
-from scipy.spatial import distance
+from scipy.spatial import cKDTree
 import glob
 import os
 import cv2
 import sys
+import cache
+import bones
+from multiprocessing import Pool, cpu_count
 
 W = 320
 H = 240
 nJoints = 12
 
 C = 3.8605e-3 #NUI_CAMERA_DEPTH_NOMINAL_INVERSE_FOCAL_LENGTH_IN_PIXELS
+bgThreshold = 0.2 # the maximum distance (m) of a foreground point to the skeleton
 np.set_printoptions(threshold=np.nan)
 
 jointNameEVAL = ['NECK', 'HEAD', 'LEFT SHOULDER', 'LEFT ELBOW', \
@@ -19,6 +23,7 @@ jointNameEVAL = ['NECK', 'HEAD', 'LEFT SHOULDER', 'LEFT ELBOW', \
 
 skeleton = [(0,1), (0,2), (2,3), (3,4), (0,5), (5,6), (6,7), (14,8), \
             (8, 9), (14,10), (10,11), (14,2), (14,5), (14,12), (14,13)]
+torsoSkel = [(2,5), (5,13), (13,12), (12,2)] # around the shoulders and hips
 
 palette = [(34, 88, 226), (34, 69, 101), (0, 195, 243), (146, 86, 135), \
            (38, 61, 43), (241, 202, 161), (50, 0, 190), (128, 178, 194), \
@@ -26,10 +31,13 @@ palette = [(34, 88, 226), (34, 69, 101), (0, 195, 243), (146, 86, 135), \
            (121, 147, 249), (151, 78, 96), (0, 166, 246), (165, 103, 0), \
            (86, 136, 0), (130, 132, 132), (0, 182, 141), (0, 132, 243)] # BGR
 
-def visualizeImgAndJoints(imgs, joints, path, show=False, write=False):
+# the images are multiplied by masks (when given) one frame at a time
+def visualizeImgAndJoints(imgs, joints, path, show=False, write=False, \
+                          masks=None):
     for i in range(imgs.shape[0]):
-        print 'average depth: %f' % np.mean(imgs[i][imgs[i] != 0])
-        img = (imgs[i]-np.amin(imgs[i]))*255.0/(np.amax(imgs[i])-np.amin(imgs[i]))
+        depth = imgs[i] if masks is None else imgs[i]*masks[i]
+        print 'average depth: %f' % np.mean(depth[depth != 0])
+        img = (depth-np.amin(depth))*255.0/(np.amax(depth)-np.amin(depth))
         img = cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_GRAY2RGB)
 
         imgSum = np.sum(img, 2)
@@ -60,96 +68,191 @@ def world2pixel(world, C):
     pixel[:, 1] = np.rint(-world[:, 1]/world[:, 2]/C + H/2.0)
     return pixel
 
-def x2yz(pt1, pt2, x):
-    y = (x-pt1[0])/(pt2[0]-pt1[0])*(pt2[1]-pt1[1])+pt1[1]
-    z = (x-pt1[0])/(pt2[0]-pt1[0])*(pt2[2]-pt1[2])+pt1[2]
-    return (y,z)
-
-def y2xz(pt1, pt2, y):
-    x = (y-pt1[1])/(pt2[1]-pt1[1])*(pt2[0]-pt1[0])+pt1[0]
-    z = (y-pt1[1])/(pt2[1]-pt1[1])*(pt2[2]-pt1[2])+pt1[2]
-    return (x,z)
-
+'''
+    The function returns the points sampled along the bones of the skeleton
+    of joints, with the hips and the torso added, and around the torso.
+'''
 def joints2skeleton(joints):
-    ptsAll = np.array([]).reshape(0, 3)
     ptsPerJoint = 5.0
     leftHip = (joints[2]+2*joints[8])/3.0
     rightHip = (joints[5]+2*joints[10])/3.0
     torso = (joints[2]+leftHip+joints[5]+rightHip)/4.0
     joints = np.vstack((joints, leftHip, rightHip, torso))
 
-    for i, jointPair in enumerate(skeleton):
-        x, y, z, nPts = None, None, None, 0
-        pt1 = joints[jointPair[0]]
-        pt2 = joints[jointPair[1]]
-
-        idx, nPts = 0, 0
-        if abs(pt1[0]-pt2[0]) < abs(pt1[1]-pt2[1]):
-            idx = 1
-
-        start = min(pt1[idx], pt2[idx])
-        end = max(pt1[idx], pt2[idx])
-        if idx == 1:
-            y = np.arange(start, end, (end-start)/ptsPerJoint)
-            x, z = y2xz(pt1, pt2, y)
-            nPts = y.shape[0]
-        else:
-            x = np.arange(start, end, (end-start)/ptsPerJoint)
-            y, z = x2yz(pt1, pt2, x)
-            nPts = x.shape[0]
-        if nPts == 0:
-            continue
-        pts = np.vstack((x, y, z)).T
-        ptsAll = np.concatenate((ptsAll, pts))
-
-    # torso
-    tl = joints[2]
-    tr = joints[5]
-    bl = joints[12]
-    br = joints[13]
-
-    torsoSkel = [(tl, tr), (tr, br), (br, bl), (bl, tl)]
-    for i, jointPair in enumerate(torsoSkel):
-        x, y, z, nPts = None, None, None, 0
-        pt1 = torsoSkel[i][0]
-        pt2 = torsoSkel[i][1]
-
-        idx, nPts = 0, 0
-        if abs(pt1[0]-pt2[0]) < abs(pt1[1]-pt2[1]):
-            idx = 1
-
-        start = min(pt1[idx], pt2[idx])
-        end = max(pt1[idx], pt2[idx])
-        if idx == 1:
-            y = np.arange(start, end, (end-start)/ptsPerJoint)
-            x, z = y2xz(pt1, pt2, y)
-            nPts = y.shape[0]
-        else:
-            x = np.arange(start, end, (end-start)/ptsPerJoint)
-            y, z = x2yz(pt1, pt2, x)
-            nPts = x.shape[0]
-        if nPts == 0:
-            continue
-
-        pts = np.vstack((x, y, z)).T
-        ptsAll = np.concatenate((ptsAll, pts))
-
-    return ptsAll
-
-def bgSub(img, joints):
-    threshold = 0.2
-    dists = distance.cdist(img, joints, 'euclidean')
-    dists = np.amin(dists, axis=1)
-
-    # a = joints2skeleton(joints)
-    # print a.shape
-    # assert False
+    pts, labels = bones.sampleSkeleton(joints[np.newaxis], skeleton+torsoSkel, \
+                                       ptsPerJoint)
+    return pts[0][labels[0] >= 0]
+
+'''
+    The function returns the mask of the points of img (N x 3, in world
+    coordinates) that are closer than threshold to a point of skeleton. The
+    nearest skeleton point of every img point is found through a KD-tree of
+    the skeleton, and the search is cut off at threshold, so no N x M
+    distance matrix is built.
+'''
+def bgSub(img, skeleton, threshold=bgThreshold):
+    dists, _ = cKDTree(skeleton).query(img, distance_upper_bound=threshold)
     return dists < threshold
 
-def main():
+lastSkeleton = [None, None] # the joints and the skeleton of the last frame
+
+'''
+    The function returns joints2skeleton(joints), reusing the skeleton of the
+    previous frame when its joints are the same.
+'''
+def getSkeleton(joints):
+    if lastSkeleton[0] is None or not np.array_equal(lastSkeleton[0], joints):
+        lastSkeleton[:] = [joints.copy(), joints2skeleton(joints)]
+    return lastSkeleton[1]
+
+'''
+    The function parses a text file of whitespace-separated x y z rows (a
+    depth frame or its joints) in one pass, much faster than np.loadtxt. It
+    returns an N x 3 array, or None when the file is missing or malformed.
+'''
+def parsePoints(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        pts = np.fromstring(f.read(), sep=' ')
+    if pts.shape[0] % 3 != 0:
+        return None
+    return pts.reshape(-1, 3)
+
+'''
+    The function returns the pixel joints, the H x W depth image and the
+    H x W foreground mask of the frame of a joints file, or None when the
+    frame is skipped.
+'''
+def procFrame(jointPath, threshold=bgThreshold):
+    imgPath = jointPath.replace('joints', 'depth')
+    joint = parsePoints(jointPath)
+    img = parsePoints(imgPath)
+    if joint is None or img is None:
+        return None
+    if joint.shape[0] != nJoints:
+        return None
+    if img.shape[0] != H*W:
+        return None
+    indicesJoint = np.nonzero(joint[:, 2])
+    indicesImg = np.nonzero(img[:, 2])
+    if len(indicesJoint[0]) == 0 or len(indicesImg[0]) == 0:
+        return None
+
+    joint[:, 2] *= -1
+    joint_pixel = world2pixel(joint, C)
+    skeleton = getSkeleton(joint)
+
+    img[:, 2] *= -1
+    img_pixel = world2pixel(img[indicesImg], C)
+    img_np = np.zeros((H, W))
+    img_np[img_pixel[:, 1].astype(int), img_pixel[:, 0].astype(int)] = img_pixel[:, 2]
+
+    img_mask = bgSub(img, skeleton, threshold)
+    img_mask_pixel = world2pixel(img[img_mask], C)
+    img_mask_np = np.zeros((H, W))
+    img_mask_np[img_mask_pixel[:, 1].astype(int), img_mask_pixel[:, 0].astype(int)] = 1
+
+    return (joint_pixel, img_np, img_mask_np)
+
+'''
+    The function parses the frames of one sequence into its cache directory,
+    which holds one slot per joints file in joints.npy, I.npy and I_mask.npy
+    and the stamps of the files every slot was parsed from in frames.json. A
+    frame whose joints and depth files are unchanged since the last run is
+    copied from the old cache instead of parsed again, unless the cache was
+    made with another background threshold. It returns the number of frames
+    that are not skipped.
+'''
+def ingestSequence(args):
+    dataset, threshold = args
+    cacheDir = dataset + '/cache'
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+
+    paths = glob.glob(dataset + '/joints/*.txt')
+    paths.sort()
+    frames = [[os.path.basename(path), cache.fileStamps([p for p in [path, \
+               path.replace('joints', 'depth')] if os.path.isfile(p)])] \
+              for path in paths]
+
+    old = {}
+    manifest = cache.readStage(cacheDir, 'frames')
+    if manifest is not None and manifest['done'] and \
+       manifest['params'].get('threshold') == threshold:
+        oldJoints = np.load(cacheDir+'/joints.npy', mmap_mode='r')
+        oldImgs = np.load(cacheDir+'/I.npy', mmap_mode='r')
+        oldMasks = np.load(cacheDir+'/I_mask.npy', mmap_mode='r')
+        for slot, (name, stamps, valid) in enumerate(manifest['params']['frames']):
+            old[name] = (stamps, valid, slot)
+
+    n = len(paths)
+    joints = np.lib.format.open_memmap(cacheDir+'/joints.tmp.npy', mode='w+', \
+        dtype=np.float64, shape=(n, nJoints, 3))
+    imgs = np.lib.format.open_memmap(cacheDir+'/I.tmp.npy', mode='w+', \
+        dtype=np.float64, shape=(n, H, W))
+    masks = np.lib.format.open_memmap(cacheDir+'/I_mask.tmp.npy', mode='w+', \
+        dtype=np.uint8, shape=(n, H, W))
+
+    nParsed = 0
+    for i, jointPath in enumerate(paths):
+        name, stamps = frames[i]
+        if name in old and old[name][0] == stamps:
+            valid, slot = old[name][1:]
+            if valid:
+                joints[i] = oldJoints[slot]
+                imgs[i] = oldImgs[slot]
+                masks[i] = oldMasks[slot]
+        else:
+            frame = procFrame(jointPath, threshold)
+            valid = frame is not None
+            if valid:
+                joints[i], imgs[i], masks[i] = frame
+            nParsed += 1
+        frames[i].append(valid)
+
+    del joints, imgs, masks
+    for name in ['joints', 'I', 'I_mask']:
+        os.rename(cacheDir+'/'+name+'.tmp.npy', cacheDir+'/'+name+'.npy')
+    params = {'frames': frames, 'threshold': threshold}
+    cache.writeStage(cacheDir, 'frames', cache.getKey(params), params, True)
+
+    nValid = sum([frame[2] for frame in frames])
+    print '%s: %d frames, %d parsed, %d skipped' % (dataset, n, nParsed, n-nValid)
+    return nValid
+
+'''
+    The function copies the frames of the cache of one sequence that are not
+    skipped into the dataset arrays, starting at frame start.
+'''
+def writeSequence(args):
+    dataset, dataDir, start = args
+    cacheDir = dataset + '/cache'
+    valid = [frame[2] for frame in \
+             cache.readStage(cacheDir, 'frames')['params']['frames']]
+    slots = np.flatnonzero(np.array(valid))
+
+    for name in ['joints', 'I', 'I_mask']:
+        src = np.load(cacheDir+'/'+name+'.npy', mmap_mode='r')
+        dst = np.load(dataDir+'/'+name+'.npy', mmap_mode='r+')
+        for k in range(0, slots.shape[0], 100):
+            dst[start+k:start+min(k+100, slots.shape[0])] = src[slots[k:k+100]]
+        dst.flush()
+
+'''
+    The function parses the depth frames and joints of every sequence of
+    dataDir in a pool of nWorkers processes, one sequence per task, and saves
+    the pixel joints, the depth images and the foreground masks of all the
+    frames to joints.npy, I.npy and I_mask.npy. The arrays are preallocated
+    as memory maps and every sequence is written into its own range of them.
+    The foreground masks keep the points within threshold of the skeleton.
+'''
+def main(dataDir='/mnt0/data/EVAL/data', nWorkers=cpu_count(), \
+         threshold=bgThreshold):
     getJpg, getJoints, getNpArray = False, False, False
-    dataDir = '/mnt0/data/EVAL/data'
     datasets = glob.glob(dataDir+'/*')
+    datasets = [dataset for dataset in datasets \
+                if os.path.isdir(dataset + '/joints')]
     datasets.sort()
     #print datasets
 
@@ -161,61 +264,31 @@ def main():
     getJoints = True
     getNpArray = True
 
-    joints = []
-    skeletons = []
-    imgs = []
-    imgs_mask = []
-
-    for dataset in datasets:
-        inImgsDir = dataset + '/depth/'
-        inJointsDir = dataset + '/joints/'
-
-        paths = glob.glob(inJointsDir + '*.txt')
-        paths.sort()
-        #print paths
-        for i, jointPath in enumerate(paths):
-            imgPath = jointPath.replace('joints', 'depth')
-            joint = np.loadtxt(jointPath)
-            img = np.loadtxt(imgPath)
-            if joint.shape[0] != nJoints:
-                continue
-            if img.shape[0] != H*W:
-                continue
-            indicesJoint = np.nonzero(joint[:, 2])
-            indicesImg = np.nonzero(img[:, 2])
-            if len(indicesJoint[0]) == 0 or len(indicesImg[0]) == 0:
-                continue
-
-            joint[:, 2] *= -1
-            joint_pixel = world2pixel(joint, C)
-            skeleton = joints2skeleton(joint)
-            skeleton_pixel = world2pixel(skeleton, C)
-
-            img[:, 2] *= -1
-            img_pixel = world2pixel(img[indicesImg], C)
-            img_np = np.zeros((H, W))
-            img_np[img_pixel[:, 1].astype(int), img_pixel[:, 0].astype(int)] = img_pixel[:, 2]
-
-            img_mask = bgSub(img, skeleton)
-            img_mask_pixel = world2pixel(img[img_mask], C)
-            img_mask_np = np.zeros((H, W))
-            img_mask_np[img_mask_pixel[:, 1].astype(int), img_mask_pixel[:, 0].astype(int)] = 1
-
-            joints.append(joint_pixel)
-            skeletons.append(skeleton_pixel)
-            imgs.append(img_np)
-            imgs_mask.append(img_mask_np)
-
-    joints = np.array(joints)
-    skeletons = np.array(skeletons)
-    imgs = np.array(imgs)
-    imgs_mask = np.array(imgs_mask)
-    #visualizeImgAndJoints(imgs_mask, skeletons)
+    pool = Pool(nWorkers)
+    counts = pool.map(ingestSequence, [(dataset, threshold) \
+                                       for dataset in datasets])
+
+    N = sum(counts)
+    starts = np.cumsum([0]+counts[:-1])
+    joints = np.lib.format.open_memmap(dataDir+'/joints.npy', mode='w+', \
+        dtype=np.float64, shape=(N, nJoints, 3))
+    imgs = np.lib.format.open_memmap(dataDir+'/I.npy', mode='w+', \
+        dtype=np.float64, shape=(N, H, W))
+    imgs_mask = np.lib.format.open_memmap(dataDir+'/I_mask.npy', mode='w+', \
+        dtype=np.float64, shape=(N, H, W))
+    del joints, imgs, imgs_mask
+
+    pool.map(writeSequence, [(dataset, dataDir, start) \
+                             for dataset, start in zip(datasets, starts)])
+    pool.close()
+    pool.join()
+
+    joints = np.load(dataDir+'/joints.npy', mmap_mode='r')
+    imgs = np.load(dataDir+'/I.npy', mmap_mode='r')
+    imgs_mask = np.load(dataDir+'/I_mask.npy', mmap_mode='r')
     print joints.shape, imgs.shape, imgs_mask.shape
-    visualizeImgAndJoints(imgs*imgs_mask, joints, path=jpgDir, write=True)
-    np.save(dataDir+'/joints.npy', joints)
-    np.save(dataDir+'/I.npy', imgs)
-    np.save(dataDir+'/I_mask.npy', imgs_mask)
+    visualizeImgAndJoints(imgs, joints, path=jpgDir, write=True, \
+                          masks=imgs_mask)
 
 def main1():
     #I_mask = np.load('/mnt0/alan/healthcare/src/poseEstimation/RTW/data_EVAL/I_mask.npy')
@@ -1,11 +1,14 @@
 import numpy as np
-import pickle
 import sys
 import argparse
 from helper import *
+import modelfile
+import cache
+import Queue
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.cluster import MiniBatchKMeans
-from multiprocessing import Process, Queue
+from multiprocessing import Pool, cpu_count, current_process
+from multiprocessing.pool import ThreadPool
 
 nSamps = 500 # the number of samples of each joint
 nFeats = 500 # the number of features of each offset point
@@ -18,59 +21,93 @@ stepSize = 3
 K = 20
 minSamplesLeaf = 400
 trainRatio = 0.7
+featChunk = 20 # the number of images per batched feature gather
+convTol = 0.05 # the running estimate shift (pixels) below which a walk is calm
+convWindow = 10 # the number of calm steps after which an adaptive walk stops
+pyramidScale = 4 # the downsampling factor of the coarse walk level
+coarseSteps = 30 # the number of steps of a coarse walk
+fineSteps = 60 # the maximum number of full resolution steps after it
+driftThreshold = 0.3 # the leaf occupancy drift above which updates refit
 
 nJoints = None
 jointName = None
 C = None
 
-def getInfoEVAL(dataDir, outDir, maxN=None, loadData=False):
-    I, joints, theta, bodyCenters = None, None, None, None
+'''
+    The function splits the EVAL images and joints saved in dataDir into the
+    train and test sets and draws the feature offsets theta. The split is
+    reused as long as the source files and the parameters are unchanged.
+'''
+def getInfoEVAL(dataDir, outDir, maxN=None):
     I_train, I_test, joints_train, joints_test = None, None, None, None
     theta, bodyCenters_train, bodyCenters_test = None, None, None
 
-    if loadData:
-        I = np.load(outDir+dataDir+'/I.npy')
-        I_mask = np.load(outDir+dataDir+'/I_mask.npy')
-        I = I*I_mask
-        joints = np.load(outDir+dataDir+'/joints.npy')
+    params = {'files': cache.fileStamps([outDir+dataDir+'/I.npy', \
+                  outDir+dataDir+'/I_mask.npy', outDir+dataDir+'/joints.npy']),
+              'nFeats': nFeats, 'maxOffFeat': maxOffFeat, \
+              'trainRatio': trainRatio}
+    key = cache.getKey(params)
+
+    if cache.isDone(outDir+dataDir, 'data', key):
+        logger.debug('data is up to date')
+        I_train = np.load(outDir+dataDir+'/I_train.npy', mmap_mode='r')
+        I_test = np.load(outDir+dataDir+'/I_test.npy', mmap_mode='r')
+        joints_train = np.load(outDir+dataDir+'/joints_train.npy')
+        joints_test = np.load(outDir+dataDir+'/joints_test.npy')
         theta = np.load(outDir+dataDir+'/theta.npy')
-        bodyCenters = np.load(outDir+dataDir+'/bodyCenters.npy')
-        N, _, _ = I.shape
+        bodyCenters_train = np.load(outDir+dataDir+'/bodyCenters_train.npy')
+        bodyCenters_test = np.load(outDir+dataDir+'/bodyCenters_test.npy')
     else:
-        mkdir(outDir+dataDir)
+        cache.writeStage(outDir+dataDir, 'data', key, params, False)
         # the N x H x W depth images and the N x nJoints x 3 joint locations
         I = np.load(outDir+dataDir+'/I.npy')
         I_mask = np.load(outDir+dataDir+'/I_mask.npy')
         I = I*I_mask
         joints = np.load(outDir+dataDir+'/joints.npy')
         theta = np.random.randint(-maxOffFeat, maxOffFeat+1, (4, nFeats))
-        leftHip = (joints[:, 2]+2*joints[:, 8])/3.0
-        rightHip = (joints[:, 5]+2*joints[:, 10])/3.0
-        bodyCenters = (joints[:, 2]+leftHip+joints[:, 5]+rightHip)/4.0
-        np.save(outDir+dataDir+'/theta', theta)
-        np.save(outDir+dataDir+'/bodyCenters', bodyCenters)
+        bodyCenters = getBodyCentersEVAL(joints)
 
-    print I.shape, joints.shape, theta.shape, bodyCenters.shape
-    nTest = I.shape[0]*(1-trainRatio)
-    I_test = I[:nTest]
-    I_train = I[nTest:]
-    joints_test = joints[:nTest]
-    joints_train = joints[nTest:]
-    bodyCenters_test = bodyCenters[:nTest]
-    bodyCenters_train = bodyCenters[nTest:]
+        print I.shape, joints.shape, theta.shape, bodyCenters.shape
+        nTest = int(I.shape[0]*(1-trainRatio))
+        I_test = I[:nTest]
+        I_train = I[nTest:]
+        joints_test = joints[:nTest]
+        joints_train = joints[nTest:]
+        bodyCenters_test = bodyCenters[:nTest]
+        bodyCenters_train = bodyCenters[nTest:]
+
+        np.save(outDir+dataDir+'/I_train', I_train)
+        np.save(outDir+dataDir+'/I_test', I_test)
+        np.save(outDir+dataDir+'/joints_train', joints_train)
+        np.save(outDir+dataDir+'/joints_test', joints_test)
+        np.save(outDir+dataDir+'/theta', theta)
+        np.save(outDir+dataDir+'/bodyCenters_train', bodyCenters_train)
+        np.save(outDir+dataDir+'/bodyCenters_test', bodyCenters_test)
+        cache.writeStage(outDir+dataDir, 'data', key, params, True)
 
     logger.debug('#train: %d, #test: %d', I_train.shape[0], I_test.shape[0])
     return (I_train, I_test, joints_train, joints_test, theta, \
         bodyCenters_train, bodyCenters_test)
 
-def getInfoITOP(depthDir, dataDir, outDir, isTop=False, maxN=None, \
-                loadData=False):
+'''
+    The function loads the ITOP images and joints of depthDir into the train
+    and test sets and draws the feature offsets theta. They are reused as
+    long as the source files and the parameters are unchanged.
+'''
+def getInfoITOP(depthDir, dataDir, outDir, isTop=False, maxN=None):
     I_train, I_test, joints_train, joints_test = None, None, None, None
     theta, bodyCenters_train, bodyCenters_test = None, None, None
 
-    if loadData:
-        I_train = np.load(outDir+dataDir+'/I_train.npy')
-        I_test = np.load(outDir+dataDir+'/I_test.npy')
+    fileName = 'top.npy' if isTop else 'side.npy'
+    params = {'files': cache.fileStamps(glob.glob(depthDir+'/*_'+fileName)),
+              'isTop': isTop, 'maxN': maxN, 'nFeats': nFeats, \
+              'maxOffFeat': maxOffFeat}
+    key = cache.getKey(params)
+
+    if cache.isDone(outDir+dataDir, 'data', key):
+        logger.debug('data is up to date')
+        I_train = np.load(outDir+dataDir+'/I_train.npy', mmap_mode='r')
+        I_test = np.load(outDir+dataDir+'/I_test.npy', mmap_mode='r')
         joints_train = np.load(outDir+dataDir+'/joints_train.npy')
         joints_test = np.load(outDir+dataDir+'/joints_test.npy')
         theta = np.load(outDir+dataDir+'/theta.npy')
@@ -78,161 +115,482 @@ def getInfoITOP(depthDir, dataDir, outDir, isTop=False, maxN=None, \
         bodyCenters_test = np.load(outDir+dataDir+'/bodyCenters_test.npy')
     else:
         mkdir(outDir+dataDir)
+        cache.writeStage(outDir+dataDir, 'data', key, params, False)
 
-        # the N x H x W depth images and the N x nJoints x 3 joint locations
+        # the N x H x W depth images and the N x nJoints x 3 joint locations;
+        # the images are decoded straight into I_train.npy and I_test.npy
         I_train, I_test, joints_train, joints_test = \
-            getImgsAndJointsITOP(depthDir, nJoints, isTop, maxN)
+            getImgsAndJointsITOP(depthDir, nJoints, isTop, maxN, \
+                                 outDir+dataDir+'/')
 
         theta = np.random.randint(-maxOffFeat, maxOffFeat+1, (4, nFeats))
-        bodyCenters_train = (joints_train[:, 1]+joints_train[:, 9]+ \
-                                joints_train[:, 10])/3
-        bodyCenters_test = (joints_test[:, 1]+joints_test[:, 9]+ \
-                               joints_test[:, 10])/3
+        bodyCenters_train = getBodyCentersITOP(joints_train)
+        bodyCenters_test = getBodyCentersITOP(joints_test)
 
-        np.save(outDir+dataDir+'/I_train', I_train)
-        np.save(outDir+dataDir+'/I_test', I_test)
         np.save(outDir+dataDir+'/joints_train', joints_train)
         np.save(outDir+dataDir+'/joints_test', joints_test)
         np.save(outDir+dataDir+'/theta', theta)
         np.save(outDir+dataDir+'/bodyCenters_train', bodyCenters_train)
         np.save(outDir+dataDir+'/bodyCenters_test', bodyCenters_test)
+        cache.writeStage(outDir+dataDir, 'data', key, params, True)
 
     logger.debug('#train: %d, #test: %d', I_train.shape[0], I_test.shape[0])
     return (I_train, I_test, joints_train, joints_test, theta, \
         bodyCenters_train, bodyCenters_test)
 
+'''
+    The functions return the body centers of the N x nJoints x 3 joints: the
+    center of the hips and shoulders (EVAL) or of the neck and hips (ITOP).
+'''
+def getBodyCentersEVAL(joints):
+    leftHip = (joints[:, 2]+2*joints[:, 8])/3.0
+    rightHip = (joints[:, 5]+2*joints[:, 10])/3.0
+    return (joints[:, 2]+leftHip+joints[:, 5]+rightHip)/4.0
+
+def getBodyCentersITOP(joints):
+    return (joints[:, 1]+joints[:, 9]+joints[:, 10])/3
+
+'''
+    The function loads the frames of newly recorded people from updateDir,
+    laid out like depthDir (ITOP) or like the EVAL dataDir, as extra training
+    data stored in dataDir/update. It returns that directory and the images,
+    joints and body centers of the new frames.
+'''
+def getUpdateData(updateDir, dataDir, outDir, ITOP, isTop=False):
+    updDir = dataDir+'/update'
+    mkdir(outDir+updDir)
+
+    if ITOP:
+        fileName = 'top.npy' if isTop else 'side.npy'
+        files = glob.glob(updateDir+'/*_'+fileName)
+    else:
+        files = [updateDir+'/I.npy', updateDir+'/I_mask.npy', \
+                 updateDir+'/joints.npy']
+    params = {'files': cache.fileStamps(files), 'isTop': isTop, \
+              'base': cache.readStage(outDir+dataDir, 'data')['key'], \
+              'theta': cache.fileHash(outDir+dataDir+'/theta.npy')}
+    key = cache.getKey(params)
+
+    if cache.isDone(outDir+updDir, 'data', key):
+        I = np.load(outDir+updDir+'/I_train.npy', mmap_mode='r')
+        joints = np.load(outDir+updDir+'/joints_train.npy')
+        bodyCenters = np.load(outDir+updDir+'/bodyCenters_train.npy')
+    else:
+        cache.writeStage(outDir+updDir, 'data', key, params, False)
+        if ITOP:
+            nPeople = len(glob.glob(updateDir+'/*_depth_'+fileName))
+            I, _, joints, _ = getImgsAndJointsITOP(updateDir, nJoints, isTop, \
+                outPrefix=outDir+updDir+'/', trainTest=[0]*nPeople)
+            bodyCenters = getBodyCentersITOP(joints)
+        else:
+            I = np.load(updateDir+'/I.npy')*np.load(updateDir+'/I_mask.npy')
+            joints = np.load(updateDir+'/joints.npy')
+            bodyCenters = getBodyCentersEVAL(joints)
+            np.save(outDir+updDir+'/I_train', I)
+        np.save(outDir+updDir+'/joints_train', joints)
+        np.save(outDir+updDir+'/bodyCenters_train', bodyCenters)
+        cache.writeStage(outDir+updDir, 'data', key, params, True)
+
+    logger.debug('#update: %d', I.shape[0])
+    return (updDir, I, joints, bodyCenters)
+
 '''
     The function creates the training samples.
     Each sample is (i, q, u, f), where i is the index of the depth image, q is
     the random offset point, u is the unit direction vector toward the joint
     location, and f is the feature array.
+    The samples are streamed to disk in chunks of images, in the samples
+    directory of nSamps (see getSamplesDir): su<jointID>.dat and
+    sf<jointID>.dat hold the float32 unit directions and features of the
+    samples whose features are not all zero, and samples<jointID>.txt records
+    how many images and rows have been written. A run with the same samples
+    key (see getSamplesKey) reuses the samples, or resumes after the last
+    recorded chunk when it was interrupted. It returns read-only memory maps
+    of the nRows x 3 directions and the nRows x nFeats features.
+'''
+def getSamples(dataDir, outDir, jointID, theta, I, bodyCenters, joints):
+    return getSamplesMulti(dataDir, outDir, [jointID], theta, I, \
+                           bodyCenters, joints[:, np.newaxis])[0]
+
+'''
+    The function creates the samples of several joints in one pass over the
+    images. joints is the N x len(jointIDs) x 3 locations of the joints.
+    Every chunk of images is converted and filled once, and then read by the
+    feature gathers of all the joints, each appending to its own files as in
+    getSamples. It returns the (S_u, S_f) memory maps of every joint.
 '''
-def getSamples(dataDir, outDir, jointID, theta, I, bodyCenters, joints, \
-               loadData=False):
-    S_u, S_f = None, None
+def getSamplesMulti(dataDir, outDir, jointIDs, theta, I, bodyCenters, joints):
     nTrain, _, _ = I.shape
 
-    if loadData:
-        print outDir+dataDir+'/sf'+str(jointID)+'.npy'
-        S_u = np.load(outDir+dataDir+'/su'+str(jointID)+'.npy')
-        S_f = np.load(outDir+dataDir+'/sf'+str(jointID)+'.npy')
+    mkdir(getSamplesDir(dataDir, outDir))
+    stores = [openSamples(dataDir, outDir, jointID, nTrain) \
+              for jointID in jointIDs]
+    files = [(open(store['su'], 'ab'), open(store['sf'], 'ab')) \
+             for store in stores]
+
+    names = ', '.join([jointName[jointID] for jointID in jointIDs])
+    for start in range(min([store['nDone'] for store in stores]), nTrain, \
+                       featChunk):
+        end = min(start+featChunk, nTrain)
+        if start%100 == 0:
+            logger.debug('joint %s: processing image %d/%d', names, start, \
+                         nTrain)
+        chunk = I[start:end].reshape(end-start, H*W)
+        F = fillBackground(chunk)
+
+        for j, store in enumerate(stores):
+            first = max(start, store['nDone'])
+            if first >= end:
+                continue
+            offsetXY = np.random.randint(-maxOffSampXY, maxOffSampXY+1, \
+                                         (end-first, nSamps, 2))
+            offsetZ = np.random.uniform(-maxOffSampZ, maxOffSampZ, \
+                                        (end-first, nSamps, 1))
+            offset = np.concatenate((offsetXY, offsetZ), axis=2)
+            norm = np.linalg.norm(offset, axis=2)[:, :, np.newaxis]
+
+            S_u = (-offset/np.where(norm == 0, 1, norm)).astype(np.float32)
+            x, y, dq = getQueryPoints(chunk[first-start:], \
+                joints[first:end, j, np.newaxis]+offset, \
+                bodyCenters[first:end, 2])
+            frames = np.arange(end-first)[:, np.newaxis, np.newaxis]
+            i1, i2 = getOffsetIndices(x[:, :, np.newaxis], \
+                y[:, :, np.newaxis], dq[:, :, np.newaxis], theta)
+            S_f = F[first-start:][frames, i1] - F[first-start:][frames, i2]
+            S_u = S_u.reshape(-1, 3)
+            S_f = S_f.reshape(-1, nFeats)
+
+            appendSamples(store, files[j], S_u, S_f, end)
+
+    for fu, ff in files:
+        fu.close()
+        ff.close()
+
+    return [closeSamples(store) for store in stores]
+
+'''
+    The function opens the sample files of a joint for appending. Samples
+    with a different key are discarded, and whatever was written after the
+    last recorded chunk is dropped. It returns the state of the files.
+    A store of samplesDir with the parameters params holds rows copied from
+    other stores instead, and then nTrain counts those rows, not images.
+'''
+def openSamples(dataDir, outDir, jointID, nTrain, samplesDir=None, \
+                params=None):
+    if samplesDir is None:
+        samplesDir = getSamplesDir(dataDir, outDir)
+    store = {'jointID': jointID, 'dir': samplesDir, \
+             'su': samplesDir+'/su'+str(jointID)+'.dat', \
+             'sf': samplesDir+'/sf'+str(jointID)+'.dat', \
+             'progress': samplesDir+'/samples'+str(jointID)+'.txt', \
+             'stage': 'samples'+str(jointID)}
+    if params is None:
+        store['key'], store['params'] = getSamplesKey(dataDir, outDir, jointID)
+        store['nIn'] = nTrain*nSamps
     else:
-        mkdir(outDir+dataDir)
+        store['key'], store['params'] = cache.getKey(params), params
+        store['nIn'] = nTrain
+
+    nDone, nRows = 0, 0
+    manifest = cache.readStage(store['dir'], store['stage'])
+    if manifest is not None and manifest['key'] == store['key'] and \
+            os.path.isfile(store['progress']):
+        nDone, nRows = np.loadtxt(store['progress'], dtype=int)
+    else:
+        cache.writeStage(store['dir'], store['stage'], store['key'], \
+                         store['params'], False)
+        np.savetxt(store['progress'], [[0, 0]], fmt='%d')
 
-        S_u = np.empty((nTrain, nSamps, 3), dtype=np.float16)
-        S_f = np.empty((nTrain, nSamps, nFeats), dtype=np.float16)
+    # drop whatever was written after the last recorded chunk
+    with open(store['su'], 'ab') as f:
+        f.truncate(nRows*3*4)
+    with open(store['sf'], 'ab') as f:
+        f.truncate(nRows*nFeats*4)
 
-        for i in range(nTrain):
-            if i%100 == 0:
-                logger.debug('joint %s: processing image %d/%d', \
-                    jointName[jointID], i, nTrain)
-            for j in range(nSamps):
-                offsetXY = np.random.randint(-maxOffSampXY, maxOffSampXY+1, 2)
-                offsetZ = np.random.uniform(-maxOffSampZ, maxOffSampZ, 1)
-                offset = np.concatenate((offsetXY, offsetZ))
+    if nDone < nTrain:
+        logger.debug('joint %s: generating samples from image %d/%d', \
+            jointName[jointID], nDone, nTrain)
 
-                S_u[i, j] = 0 if np.linalg.norm(offset) == 0 else \
-                                            -offset/np.linalg.norm(offset)
-                S_f[i, j] = getFeatures(I[i], theta, joints[i]+offset, \
-                                            bodyCenters[i][2])
+    store['nDone'], store['nRows'] = nDone, nRows
+    return store
 
-        np.save(outDir+dataDir+'/su'+str(jointID), S_u)
-        np.save(outDir+dataDir+'/sf'+str(jointID), S_f)
+'''
+    The function appends the samples whose features are not all zero to the
+    files of a joint and records that the images up to end are done.
+'''
+def appendSamples(store, files, S_u, S_f, end):
+    fu, ff = files
+    rows = np.any(S_f != 0, axis=1)
+    S_u[rows].tofile(fu)
+    S_f[rows].tofile(ff)
+    fu.flush()
+    ff.flush()
+    os.fsync(fu.fileno())
+    os.fsync(ff.fileno())
+
+    store['nDone'] = end
+    store['nRows'] += np.sum(rows)
+    np.savetxt(store['progress']+'.tmp', [[end, store['nRows']]], fmt='%d')
+    os.rename(store['progress']+'.tmp', store['progress'])
+
+def closeSamples(store):
+    nRows = store['nRows']
+    logger.debug('joint %s - valid samples: %d/%d', \
+        jointName[store['jointID']], nRows, store['nIn'])
+    cache.writeStage(store['dir'], store['stage'], store['key'], \
+                     store['params'], True)
+
+    S_u = np.memmap(store['su'], dtype=np.float32, mode='r', \
+                    shape=(nRows, 3))
+    S_f = np.memmap(store['sf'], dtype=np.float32, mode='r', \
+                    shape=(nRows, nFeats))
 
     return (S_u, S_f)
 
+'''
+    The function returns the directory of the sample stores of the data in
+    dataDir. Every nSamps has its own stores, so runs with different nSamps
+    share the data without discarding each other's samples.
+'''
+def getSamplesDir(dataDir, outDir):
+    return outDir+dataDir+'/nSamps'+str(nSamps)
+
+'''
+    The function returns the key and the parameters of the samples of a
+    joint: the data they are drawn from, the content of its theta (which is
+    drawn again whenever the data stage reruns) and the sampling parameters.
+    The update data has no theta of its own, and its data key holds the
+    content of the base theta instead (see getUpdateData).
+'''
+def getSamplesKey(dataDir, outDir, jointID):
+    thetaPath = outDir+dataDir+'/theta.npy'
+    params = {'data': cache.readStage(outDir+dataDir, 'data')['key'], \
+              'theta': cache.fileHash(thetaPath) \
+                  if os.path.isfile(thetaPath) else None, \
+              'jointID': jointID, 'nSamps': nSamps, \
+              'maxOffSampXY': maxOffSampXY, 'maxOffSampZ': maxOffSampZ, \
+              'largeNum': largeNum}
+    return (cache.getKey(params), params)
+
 def getFeatures(img, theta, q, z):
-    img[img == 0] = largeNum
-    coor = q[:2][::-1] # coor: y, x
-    coor[0] = np.clip(coor[0], 0, H-1)
-    coor[1] = np.clip(coor[1], 0, W-1)
-    coor = np.rint(coor).astype(int)
-    dq = z if img[tuple(coor)] == largeNum else img[tuple(coor)]
+    q = np.asarray(q, dtype=float).reshape(1, 1, 3)
+    return getFeaturesBatch(img[np.newaxis], theta, q, [z])[0, 0]
 
-    x1 = np.clip(coor[1]+theta[0]/dq, 0, W-1).astype(int)
-    y1 = np.clip(coor[0]+theta[1]/dq, 0, H-1).astype(int)
-    x2 = np.clip(coor[1]+theta[2]/dq, 0, W-1).astype(int)
-    y2 = np.clip(coor[0]+theta[3]/dq, 0, H-1).astype(int)
+'''
+    The function computes the features of a stack of depth images at once.
+    I is the N x H x W depth images, qs is the N x M x 3 query points and z is
+    the N depths used when a query point falls on the background. It returns
+    the N x M x nFeats features. I and qs are not modified. When frames is
+    given, the query points qs[n] are in the image I[frames[n]].
+'''
+def getFeaturesBatch(I, theta, qs, z, frames=None):
+    shape = I.shape[1:]
+    I = I.reshape(I.shape[0], shape[0]*shape[1])
+    if frames is None:
+        frames = np.arange(qs.shape[0])
+    x, y, dq = getQueryPoints(I, qs, z, frames, shape)
+    frames = frames[:, np.newaxis, np.newaxis]
 
-    return img[y1, x1] - img[y2, x2]
+    return getDepthDiffs(I, frames, x[:, :, np.newaxis], y[:, :, np.newaxis], \
+                         dq[:, :, np.newaxis], theta, shape)
 
-def stochastic(regressor, features, unitDirections):
-    indices = regressor.apply(features) # leaf id of each sample
-    leafIDs = np.unique(indices) # array of unique leaf ids
-    L = {}
+'''
+    The function returns the rounded pixel coordinates and the depths of the
+    N x M query points qs in the N x (H*W) depth images I (in the images
+    frames of I when given). shape is the height and width of the images.
+'''
+def getQueryPoints(I, qs, z, frames=None, shape=(H, W)):
+    h, w = shape
+    if frames is None:
+        frames = np.arange(I.shape[0])
+    frames = frames[:, np.newaxis]
+    x = np.rint(np.clip(qs[:, :, 0], 0, w-1)).astype(int)
+    y = np.rint(np.clip(qs[:, :, 1], 0, h-1)).astype(int)
+    dq = I[frames, y*w+x].astype(np.float32)
+    dq = np.where(dq == 0, np.asarray(z, np.float32)[:, np.newaxis], dq)
+
+    return (x, y, dq)
 
-    logger.debug('MiniBatchKMeans...')
-    for leafID in leafIDs:
-        kmeans = MiniBatchKMeans(n_clusters=K, batch_size=1000)
-        labels = kmeans.fit_predict(unitDirections[indices == leafID])
-        weights = np.bincount(labels).astype(float)/labels.shape[0]
-        centers = kmeans.cluster_centers_
-        centers /= np.linalg.norm(centers, axis=1)[:, np.newaxis]
-        #checkUnitVectors(centers)
+'''
+    The function returns the flat indices of the pixels at the offsets theta
+    of the query points (x, y) of depth dq, in images of the given shape.
+'''
+def getOffsetIndices(x, y, dq, theta, shape=(H, W)):
+    h, w = shape
+    x1 = np.clip(x+theta[0]/dq, 0, w-1).astype(int)
+    y1 = np.clip(y+theta[1]/dq, 0, h-1).astype(int)
+    x2 = np.clip(x+theta[2]/dq, 0, w-1).astype(int)
+    y2 = np.clip(y+theta[3]/dq, 0, h-1).astype(int)
 
-        L[leafID] = (weights, centers)
+    return (y1*w+x1, y2*w+x2)
 
-    return L
+'''
+    The function returns the depth differences at the offsets theta of the
+    query points (x, y) of depth dq, in the images frames of I.
+'''
+def getDepthDiffs(I, frames, x, y, dq, theta, shape=(H, W)):
+    i1, i2 = getOffsetIndices(x, y, dq, theta, shape)
 
-def trainModel(X, y, jointID, modelsDir, outDir, loadModels=False):
-    regressor, L = None, None
+    d1 = I[frames, i1].astype(np.float32)
+    d2 = I[frames, i2].astype(np.float32)
+    d1[d1 == 0] = largeNum
+    d2[d2 == 0] = largeNum
 
-    mkdir(outDir+modelsDir)
+    return d1 - d2
 
-    regressorPath = outDir + modelsDir + '/regressor' + str(jointID) + '.pkl'
-    LPath = outDir + modelsDir + '/L' + str(jointID) + '.pkl'
+'''
+    The function returns the N x (H*W) float32 depths of the N x (H*W) images
+    I with the background set to largeNum, as the feature gathers read them.
+'''
+def fillBackground(I):
+    F = I.astype(np.float32)
+    F[F == 0] = largeNum
+    return F
+
+'''
+    The function builds the direction distribution of every leaf, given the
+    leaf of each sample in indices. The samples are grouped by leaf with one
+    sort, and the leaves are clustered in a pool of nWorkers processes
+    (serially when already inside a worker process).
+'''
+def stochastic(indices, unitDirections, nWorkers=1):
+    order = np.argsort(indices, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(indices[order]))+1
+    leafIDs = indices[order][np.concatenate(([0], bounds))]
+    groups = np.split(np.asarray(unitDirections)[order], bounds)
 
-    if loadModels and os.path.isfile(regressorPath) and os.path.isfile(LPath):
-        logger.debug('loading model %s from files...', jointName[jointID])
-        regressor = pickle.load(open(regressorPath, 'rb'))
-        L = pickle.load(open(LPath, 'rb'))
+    logger.debug('MiniBatchKMeans...')
+    if nWorkers > 1 and not current_process().daemon:
+        pool = Pool(nWorkers)
+        results = pool.map(clusterLeaf, groups)
+        pool.close()
+        pool.join()
     else:
-        logger.debug('start training model %s...', jointName[jointID])
-        regressor = DecisionTreeRegressor(min_samples_leaf=minSamplesLeaf)
+        results = map(clusterLeaf, groups)
 
-        X_reshape = X.reshape(X.shape[0]*X.shape[1], X.shape[2])
-        y_reshape = y.reshape(y.shape[0]*y.shape[1], y.shape[2])
+    return dict(zip(leafIDs, results))
 
-        rows = np.logical_not(np.all(X_reshape == 0, axis=1))
-        regressor.fit(X_reshape[rows], y_reshape[rows])
-        logger.debug('model %s - valid samples: %d/%d', jointName[jointID], \
-            X_reshape[rows].shape[0], X_reshape.shape[0])
+'''
+    The function returns the K weights and the K x 3 unit centers of the
+    directions of one leaf. A leaf with K or fewer distinct directions is
+    described exactly instead of being clustered.
+'''
+def clusterLeaf(directions):
+    unique, counts = np.unique(directions, axis=0, return_counts=True)
+    weights = np.zeros(K)
+    centers = np.zeros((K, 3))
+
+    if unique.shape[0] <= K:
+        weights[:unique.shape[0]] = counts.astype(float)/directions.shape[0]
+        centers[:unique.shape[0]] = unique
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=K, batch_size=1000)
+        labels = kmeans.fit_predict(directions)
+        weights = np.bincount(labels, minlength=K).astype(float)/ \
+            labels.shape[0]
+        centers = kmeans.cluster_centers_
+
+    norm = np.linalg.norm(centers, axis=1)[:, np.newaxis]
+    centers /= np.where(norm == 0, 1, norm)
+    #checkUnitVectors(centers)
 
-        leafIDs = regressor.apply(X_reshape)
-        bin = np.bincount(leafIDs)
-        uniqueIDs = np.unique(leafIDs)
-        biggest = np.argmax(bin)
-        smallest = np.argmin(bin[bin != 0])
+    return (weights, centers)
 
-        logger.debug('model %s - #leaves: %d', jointName[jointID], \
-                     uniqueIDs.shape[0])
-        logger.debug('model %s - biggest leaf id: %d, #samples: %d/%d', \
-                     jointName[jointID], biggest, bin[biggest], np.sum(bin))
-        logger.debug('model %s - smallest leaf id: %d, #samples: %d/%d', \
-                     jointName[jointID], smallest, bin[bin != 0][smallest], \
-                     np.sum(bin))
-        logger.debug('model %s - average leaf size: %d', jointName[jointID], \
-                     np.sum(bin)/uniqueIDs.shape[0])
+def trainModel(X, y, jointID, modelsDir, outDir, theta, nWorkers=1, \
+               treePath=None):
+    mkdir(outDir+modelsDir)
+
+    modelPath = outDir + modelsDir + '/model' + str(jointID) + '.rtw'
+
+    tree, leaves = fitTree(X, y, jointID, treePath)
+    L = stochastic(leaves, y, nWorkers)
+    model = compileModel(tree, L, leaves)
 
-        L = stochastic(regressor, X_reshape, y_reshape)
+    saveModel(modelPath, model, theta, jointID)
 
-        pickle.dump(regressor, open(regressorPath, 'wb'))
-        pickle.dump(L, open(LPath, 'wb'))
+    # walk the model as saved (half precision leaves), like a cached run
+    return loadModel(modelPath)[0]
+
+'''
+    The function returns the path of the tree of a joint, which depends on
+    its samples and minSamplesLeaf only, so that models differing in K share
+    it.
+'''
+def getTreePath(dataDir, outDir, jointID):
+    params = {'samples': getSamplesKey(dataDir, outDir, jointID)[0], \
+              'minSamplesLeaf': minSamplesLeaf}
+    return outDir+dataDir+'/trees/'+cache.getKey(params)+'.tree'
 
-    return (regressor, L)
+'''
+    The function fits the regression tree of a joint on the samples X, y and
+    returns it compiled (see compileTree) with the leaf row of every sample.
+    When treePath is given, a tree saved there is reused and a newly fitted
+    tree is saved there.
+'''
+def fitTree(X, y, jointID, treePath=None):
+    if treePath is not None and os.path.isfile(treePath):
+        logger.debug('model %s - reusing tree %s', jointName[jointID], \
+                     treePath)
+        tree, _ = modelfile.loadArrays(treePath)
+        return (tree, tree.pop('samples'))
+
+    logger.debug('start training model %s...', jointName[jointID])
+    regressor = DecisionTreeRegressor(min_samples_leaf=minSamplesLeaf)
+
+    # X is float32 and C-contiguous, so sklearn uses it without a copy
+    regressor.fit(X, y)
+
+    leafIDs = regressor.apply(X)
+    bin = np.bincount(leafIDs)
+    uniqueIDs = np.unique(leafIDs)
+    biggest = np.argmax(bin)
+    smallest = np.argmin(bin[bin != 0])
+
+    logger.debug('model %s - #leaves: %d', jointName[jointID], \
+                 uniqueIDs.shape[0])
+    logger.debug('model %s - biggest leaf id: %d, #samples: %d/%d', \
+                 jointName[jointID], biggest, bin[biggest], np.sum(bin))
+    logger.debug('model %s - smallest leaf id: %d, #samples: %d/%d', \
+                 jointName[jointID], smallest, bin[bin != 0][smallest], \
+                 np.sum(bin))
+    logger.debug('model %s - average leaf size: %d', jointName[jointID], \
+                 np.sum(bin)/uniqueIDs.shape[0])
+
+    tree = compileTree(regressor)
+    leaves = tree['leaf'][leafIDs]
+
+    if treePath is not None:
+        mkdir(os.path.dirname(treePath))
+        arrays = dict(tree)
+        arrays['samples'] = leaves
+        modelfile.saveArrays(treePath+'.tmp', arrays, {'model': 'tree'})
+        os.rename(treePath+'.tmp', treePath)
+
+    return (tree, leaves)
 
-def testModel(regressor, L, theta, qm0, img, bodyCenter):
+'''
+    The function walks one test image for nSteps steps. With a tolerance tol,
+    the walk stops early once the running mean of its positions (in pixels)
+    has moved less than tol at each of the last window steps. It returns the
+    path (padded with its last position), the predicted joint location and
+    the number of steps taken.
+'''
+def testModel(model, theta, qm0, img, bodyCenter, lazy=False, tol=None, \
+              window=convWindow, rng=np.random):
     qm = np.zeros((nSteps+1, 3))
     qm[0] = qm0
     joint_pred = np.zeros(3)
+    calm = 0
+    nTaken = nSteps
 
     for i in range(nSteps):
-        f = getFeatures(img, theta, qm[i], bodyCenter[2]).reshape(1, -1)
-        leafID = regressor.apply(f)[0]
+        if lazy:
+            leaf = applyModelLazy(model, theta, img, qm[i], bodyCenter[2])
+        else:
+            f = getFeatures(img, theta, qm[i], bodyCenter[2])
+            leaf = applyModel(model, f)
 
-        # L[leafID][0]: weights, L[leafID][1]: centers
-        idx = np.random.choice(K, p=L[leafID][0])
-        u = L[leafID][1][idx]
+        u = sampleDirections(model, np.array([leaf]), rng)[0]
 
         qm[i+1] = qm[i] + u*stepSize
         qm[i+1][0] = np.clip(qm[i+1][0], 0, W-1)
@@ -240,9 +598,469 @@ def testModel(regressor, L, theta, qm0, img, bodyCenter):
         qm[i+1][2] = img[int(qm[i+1][1]), int(qm[i+1][0])]
         joint_pred += qm[i+1]
 
-    joint_pred = joint_pred/nSteps
+        if tol is not None and i > 0:
+            shift = np.linalg.norm(qm[i+1][:2] - joint_pred[:2]/(i+1))/i
+            calm = calm+1 if shift < tol else 0
+            if calm >= window:
+                nTaken = i+1
+                qm[i+2:] = qm[i+1]
+                break
+
+    joint_pred = joint_pred/nTaken
+
+    return (qm, joint_pred, nTaken)
+
+'''
+    The function walks all the test images of a batch in lockstep, with one
+    feature gather, one tree traversal and one direction draw per step.
+    qm0 is the N x 3 starting points. With a tolerance tol, every walk stops
+    as in testModel and only the walks still moving are stepped. A walk
+    takes at most maxSteps steps (nSteps by default). It returns the
+    N x (maxSteps+1) x 3 paths, the N x 3 predicted joint locations and the
+    N numbers of steps taken. The directions are drawn from rng.
+'''
+def testModelBatch(model, theta, qm0, I, bodyCenters, lazy=False, tol=None, \
+                   window=convWindow, maxSteps=None, rng=np.random):
+    N = I.shape[0]
+    frames = np.arange(N)
+    maxSteps = nSteps if maxSteps is None else maxSteps
+
+    qm = np.zeros((N, maxSteps+1, 3))
+    qm[:, 0] = qm0
+    qmSum = np.zeros((N, 3))
+    calm = np.zeros(N, dtype=int)
+    nTaken = np.full(N, maxSteps, dtype=int)
+    walking = frames
+
+    for i in range(maxSteps):
+        q = qm[walking, i]
+        z = bodyCenters[walking, 2]
+        if lazy:
+            leaves = applyModelLazy(model, theta, I, q, z, walking)
+        else:
+            f = getFeaturesBatch(I, theta, q[:, np.newaxis], z, walking)[:, 0]
+            leaves = applyModel(model, f)
+        u = sampleDirections(model, leaves, rng)
+
+        q = q + u*stepSize
+        q[:, 0] = np.clip(q[:, 0], 0, I.shape[2]-1)
+        q[:, 1] = np.clip(q[:, 1], 0, I.shape[1]-1)
+        q[:, 2] = I[walking, q[:, 1].astype(int), q[:, 0].astype(int)]
+        qm[walking, i+1] = q
+        qmSum[walking] += q
+
+        if tol is not None and i > 0:
+            shift = np.linalg.norm(q[:, :2] - qmSum[walking, :2]/(i+1), \
+                                   axis=1)/i
+            calm[walking] = np.where(shift < tol, calm[walking]+1, 0)
+            done = calm[walking] >= window
+            nTaken[walking[done]] = i+1
+            walking = walking[~done]
+            if walking.shape[0] == 0:
+                break
+
+    # pad the stopped paths with their last position
+    steps = np.minimum(np.arange(maxSteps+1), nTaken[:, np.newaxis])
+    qm = qm[frames[:, np.newaxis], steps]
+    joint_pred = qmSum/nTaken[:, np.newaxis]
+
+    return (qm, joint_pred, nTaken)
+
+'''
+    The function returns the coarse level of the N x H x W images I, keeping
+    the pixel at the center of every scale x scale block so that the
+    background stays 0.
+'''
+def buildPyramid(I, scale=pyramidScale):
+    return np.ascontiguousarray(I[:, scale//2::scale, scale//2::scale])
+
+'''
+    The function walks a batch of test images coarse to fine. It first takes
+    nCoarse steps of stepSize pixels on the images downsampled by scale,
+    reading the same model with the offsets theta scaled down to match, so
+    that every step crosses scale times more of the body. The walk then
+    starts again at full resolution from the mean of the second half of the
+    coarse path and takes at most nFine steps, stopping early with tol as in
+    testModelBatch. It returns the paths (the coarse path in full resolution
+    pixels followed by the fine path, padded to nSteps+1 positions), the
+    predicted joint locations, which average the fine path only, and the
+    total numbers of steps taken. The two walks fit in nSteps: the coarse
+    walk leaves at least one fine step, and with nSteps below 2 there is
+    no coarse walk and the images are walked as in testModelBatch.
+'''
+def testModelPyramid(model, theta, qm0, I, bodyCenters, lazy=False, \
+                     tol=None, window=convWindow, rng=np.random, \
+                     scale=pyramidScale, nCoarse=coarseSteps, nFine=fineSteps):
+    N = I.shape[0]
+    nCoarse = max(0, min(nCoarse, nSteps-1))
+    nFine = min(nFine, nSteps-nCoarse)
+    if nCoarse == 0:
+        return testModelBatch(model, theta, qm0, I, bodyCenters, lazy, tol, \
+                              window, rng=rng)
+
+    qc = np.array(qm0, dtype=float)
+    qc[:, :2] = (qc[:, :2]-scale//2)/float(scale)
+    qmCoarse, _, _ = testModelBatch(model, theta/float(scale), qc, \
+        buildPyramid(I, scale), bodyCenters, lazy, maxSteps=nCoarse, rng=rng)
+    qmCoarse[:, :, :2] = qmCoarse[:, :, :2]*scale+scale//2
+
+    qf = np.mean(qmCoarse[:, nCoarse//2+1:], axis=1)
+    qmFine, joint_pred, nTaken = testModelBatch(model, theta, qf, I, \
+        bodyCenters, lazy, tol, window, nFine, rng)
+
+    qm = np.zeros((N, nSteps+1, 3))
+    qm[:, :nCoarse+1] = qmCoarse
+    qm[:, nCoarse+1:nCoarse+nFine+1] = qmFine[:, 1:]
+    qm[:, nCoarse+nFine+1:] = qmFine[:, -1:]
+
+    return (qm, joint_pred, nCoarse+nTaken)
+
+'''
+    The function returns the total variation distance between the leaf
+    occupancy of the training samples of a model and that of new samples
+    falling in the leaf rows leaves.
+'''
+def getLeafDrift(model, leaves):
+    old = model['counts']/float(np.sum(model['counts']))
+    new = np.bincount(leaves, minlength=old.shape[0])/float(leaves.shape[0])
+    return 0.5*np.sum(np.abs(new-old))
+
+'''
+    The function adds new samples, given by their leaf rows and unit
+    directions, to the direction distributions of a model. Every direction
+    joins the nearest center of its leaf, which moves to the mean of its
+    old and new directions, and the weights and counts of the leaf grow
+    accordingly. Only the leaves that receive samples change. It returns the
+    updated copy of the model.
+'''
+def updateLeaves(model, leaves, directions):
+    model = dict([(name, np.array(arr)) for name, arr in model.items()])
+    weights = model['weights'].astype(float)
+    centers = model['centers'].astype(float)
+    counts = model['counts'].astype(np.int64)
+
+    order = np.argsort(leaves, kind='mergesort')
+    rows, starts = np.unique(leaves[order], return_index=True)
+    for row, dirs in zip(rows, np.split(directions[order], starts[1:])):
+        n = weights[row]*counts[row] # the samples of every cluster
+        dots = np.dot(dirs, centers[row].T)
+        dots[:, n == 0] = -np.inf
+        nearest = np.argmax(dots, axis=1)
+
+        sums = np.zeros((K, 3))
+        np.add.at(sums, nearest, dirs)
+        added = np.bincount(nearest, minlength=K)
+        c = centers[row]*n[:, np.newaxis] + sums
+        norm = np.linalg.norm(c, axis=1)[:, np.newaxis]
+        centers[row] = np.where(added[:, np.newaxis] > 0, \
+                                c/np.where(norm == 0, 1, norm), centers[row])
+
+        n += added
+        weights[row] = n/np.sum(n)
+        counts[row] += dirs.shape[0]
+
+    model['weights'], model['centers'] = weights, centers
+    model['counts'] = counts.astype(np.int32)
+    return model
+
+'''
+    The function returns the memory maps of the base samples of a joint
+    followed by its update samples, for refitting the joint. They are
+    copied in chunks to a store of the update directory, which is reused by
+    later refits with the same base and update samples.
+'''
+def joinSamples(dataDir, updDir, outDir, jointID, base, update):
+    params = {'base': getSamplesKey(dataDir, outDir, jointID)[0], \
+              'update': getSamplesKey(updDir, outDir, jointID)[0]}
+    samplesDir = getSamplesDir(updDir, outDir)+'/refit'
+    nIn = base[1].shape[0]+update[1].shape[0]
+
+    mkdir(samplesDir)
+    store = openSamples(updDir, outDir, jointID, nIn, samplesDir, params)
+    files = (open(store['su'], 'ab'), open(store['sf'], 'ab'))
+
+    chunk = featChunk*nSamps
+    offset = 0
+    for S_u, S_f in [base, update]:
+        for start in range(max(store['nDone']-offset, 0), S_f.shape[0], \
+                           chunk):
+            end = min(start+chunk, S_f.shape[0])
+            appendSamples(store, files, np.asarray(S_u[start:end]), \
+                          np.asarray(S_f[start:end]), offset+end)
+        offset += S_f.shape[0]
+
+    for f in files:
+        f.close()
+
+    return closeSamples(store)
+
+'''
+    The function updates the models of all the joints with the frames of new
+    people returned by getUpdateData, unless they already hold them. The new
+    samples are routed through each tree; a joint whose leaf occupancy
+    drifts by more than driftThreshold is refit on its base samples plus the
+    new ones, and the other joints only update the leaves the new samples
+    reach. The model manifests keep the key of the base model.
+'''
+def updateModels(models, dataDir, modelsDir, outDir, theta, update, train, \
+                 nWorkers=1):
+    updDir, I, joints, bodyCenters = update
+    I_train, joints_train, bodyCenters_train = train
+
+    pending = []
+    for jointID in range(nJoints):
+        manifest = cache.readStage(outDir+modelsDir, 'model'+str(jointID))
+        updKey = getSamplesKey(updDir, outDir, jointID)[0]
+        if updKey in manifest['params'].get('updates', []):
+            logger.debug('model %s is up to date', jointName[jointID])
+        else:
+            pending.append((jointID, manifest, updKey))
+    if len(pending) == 0:
+        return
+
+    jointIDs = [jointID for jointID, _, _ in pending]
+    samples = getSamplesMulti(updDir, outDir, jointIDs, theta, I, \
+                              bodyCenters, joints[:, jointIDs])
+
+    for (jointID, manifest, updKey), (S_u, S_f) in zip(pending, samples):
+        stage = 'model'+str(jointID)
+        params = {'base': manifest['params'].get('base', manifest['key']), \
+                  'updates': manifest['params'].get('updates', [])+[updKey]}
+        cache.writeStage(outDir+modelsDir, stage, manifest['key'], \
+                         manifest['params'], False)
+
+        chunk = featChunk*nSamps
+        leaves = np.concatenate([applyModel(models[jointID], \
+            np.asarray(S_f[k:k+chunk])) for k in range(0, S_f.shape[0], chunk)])
+        drift = getLeafDrift(models[jointID], leaves)
+
+        if drift > driftThreshold:
+            logger.debug('model %s - leaf drift: %f, refitting', \
+                         jointName[jointID], drift)
+            base = getSamples(dataDir, outDir, jointID, theta, I_train, \
+                bodyCenters_train, joints_train[:, jointID])
+            S_u1, S_f1 = joinSamples(dataDir, updDir, outDir, jointID, base, \
+                                     (S_u, S_f))
+            models[jointID] = trainModel(S_f1, S_u1, jointID, modelsDir, \
+                                         outDir, theta, nWorkers)
+        else:
+            logger.debug('model %s - leaf drift: %f, updating %d leaves', \
+                         jointName[jointID], drift, np.unique(leaves).shape[0])
+            modelPath = outDir+modelsDir+'/model'+str(jointID)+'.rtw'
+            saveModel(modelPath, updateLeaves(models[jointID], leaves, \
+                      np.asarray(S_u)), theta, jointID)
+            models[jointID] = loadModel(modelPath)[0]
+
+        cache.writeStage(outDir+modelsDir, stage, cache.getKey(params), \
+                         params, True)
+
+'''
+    The function returns the random state of the walks of a joint. With a
+    seed, every joint draws from its own stream, so the walks of a joint do
+    not depend on the order in which the joints are walked.
+'''
+def getJointRng(seed, jointID):
+    return np.random if seed is None else \
+        np.random.RandomState([seed, jointID])
+
+'''
+    The function walks all the joints of a batch of test images, starting
+    each joint as soon as the walk of its kinematic parent is finished, in a
+    pool of nWorkers threads that share the images. A joint walks exactly as
+    in testModelBatch with the random state getJointRng(seed, jointID), so
+    for a fixed seed the results do not depend on nWorkers. The paths of a
+    joint are handed to onDone(jointID, qm), when given, as soon as it is
+    finished. It returns the predicted locations and the numbers of steps of
+    every joint, in dicts keyed by joint id.
+'''
+def testModelsDAG(models, theta, I, bodyCenters, kinemOrder, kinemParent, \
+                  lazy=False, tol=None, window=convWindow, seed=None, \
+                  nWorkers=1, onDone=None):
+    parents = dict(zip(kinemOrder, kinemParent))
+    children = dict([(jointID, []) for jointID in kinemOrder])
+    for jointID in kinemOrder:
+        if parents[jointID] != -1:
+            children[parents[jointID]].append(jointID)
+
+    joints_pred, stepsTaken = {}, {}
+    done = Queue.Queue()
+
+    def walk(jointID):
+        try:
+            qm0 = bodyCenters if parents[jointID] == -1 \
+                else joints_pred[parents[jointID]]
+            rng = getJointRng(seed, jointID) if seed is not None \
+                else np.random.RandomState()
+            return (jointID, testModelBatch(models[jointID], theta, qm0, I, \
+                bodyCenters, lazy, tol, window, rng=rng))
+        except Exception, e:
+            logger.exception('walking model %s failed', jointName[jointID])
+            return (jointID, e)
+
+    pool = ThreadPool(nWorkers)
+    for jointID in kinemOrder:
+        if parents[jointID] == -1:
+            pool.apply_async(walk, (jointID,), callback=done.put)
+
+    for _ in range(len(kinemOrder)):
+        jointID, result = done.get()
+        if isinstance(result, Exception):
+            pool.terminate()
+            raise result
+        logger.debug('model %s tested', jointName[jointID])
+        qm, joints_pred[jointID], stepsTaken[jointID] = result
+        if onDone is not None:
+            onDone(jointID, qm)
+        for child in children[jointID]:
+            pool.apply_async(walk, (child,), callback=done.put)
+
+    pool.close()
+    pool.join()
+
+    return (joints_pred, stepsTaken)
+
+'''
+    The function compiles a trained regressor into flat arrays. feature,
+    threshold, left and right describe the nodes (left is -1 at a leaf) and
+    leaf maps every node to its leaf row (-1 at a split node).
+'''
+def compileTree(regressor):
+    tree = regressor.tree_
+    left = tree.children_left.astype(np.int32)
+    right = tree.children_right.astype(np.int32)
+    isLeaf = left == -1
+    leafIDs = np.flatnonzero(isLeaf)
+
+    leaf = -np.ones(tree.node_count, dtype=np.int32)
+    leaf[leafIDs] = np.arange(leafIDs.shape[0])
+
+    return {'feature': np.where(isLeaf, 0, tree.feature).astype(np.int32),
+            'threshold': tree.threshold.astype(np.float32),
+            'left': left, 'right': right, 'leaf': leaf}
+
+'''
+    The function completes a compiled tree with the leaf dictionary L (keyed
+    by leaf row) into a model: the nLeaves x K weights and nLeaves x K x 3
+    centers tables, and counts, the number of training samples of every leaf
+    row, counted from the leaf rows of the samples leaves.
+'''
+def compileModel(tree, L, leaves):
+    nLeaves = np.max(tree['leaf'])+1
+    weights = np.zeros((nLeaves, K))
+    centers = np.zeros((nLeaves, K, 3))
+    for row, (w, c) in L.items():
+        weights[row, :w.shape[0]] = w
+        centers[row, :c.shape[0]] = c
+
+    model = dict(tree)
+    model['weights'], model['centers'] = weights, centers
+    model['counts'] = np.bincount(leaves, minlength=nLeaves).astype(np.int32)
+    return model
+
+'''
+    The function traverses a compiled model. X is a single feature array or
+    an n x nFeats array; it returns the leaf row of each of them.
+'''
+def applyModel(model, X):
+    feature, threshold = model['feature'], model['threshold']
+    left, right = model['left'], model['right']
+    X = np.asarray(X, dtype=np.float32)
+
+    if X.ndim == 1:
+        node = 0
+        while left[node] != -1:
+            node = left[node] if X[feature[node]] <= threshold[node] \
+                else right[node]
+        return model['leaf'][node]
+
+    # move all the points one level down at a time
+    nodes = np.zeros(X.shape[0], dtype=np.int32)
+    active = np.flatnonzero(left[nodes] != -1)
+    while active.shape[0] > 0:
+        nd = nodes[active]
+        goLeft = X[active, feature[nd]] <= threshold[nd]
+        nd = np.where(goLeft, left[nd], right[nd])
+        nodes[active] = nd
+        active = active[left[nd] != -1]
+
+    return model['leaf'][nodes]
+
+'''
+    The function traverses a compiled model for one query point per image,
+    computing a feature only when a node on the path of the point reads it.
+    I is the N x H x W depth images, q the N x 3 query points and z the N
+    background depths. It returns the same leaf rows as applyModel on the
+    output of getFeaturesBatch. A single H x W image with a single query
+    point is walked down the tree with scalar lookups.
+'''
+def applyModelLazy(model, theta, I, q, z, frames=None):
+    feature, threshold = model['feature'], model['threshold']
+    left, right = model['left'], model['right']
+
+    if I.ndim == 2:
+        x = int(np.rint(np.clip(q[0], 0, W-1)))
+        y = int(np.rint(np.clip(q[1], 0, H-1)))
+        dq = I.item(y, x) or float(np.float32(z))
+
+        node = 0
+        while left[node] != -1:
+            t0, t1, t2, t3 = theta[:, feature[node]].tolist()
+            d1 = I.item(min(max(int(y+t1/dq), 0), H-1), \
+                        min(max(int(x+t0/dq), 0), W-1)) or largeNum
+            d2 = I.item(min(max(int(y+t3/dq), 0), H-1), \
+                        min(max(int(x+t2/dq), 0), W-1)) or largeNum
+            node = left[node] if d1-d2 <= threshold[node] else right[node]
+        return model['leaf'][node]
+
+    N = q.shape[0]
+    shape = I.shape[1:]
+    I = I.reshape(I.shape[0], shape[0]*shape[1])
+    if frames is None:
+        frames = np.arange(N)
+    x, y, dq = getQueryPoints(I, q[:, np.newaxis], z, frames, shape)
+    x, y, dq = x[:, 0], y[:, 0], dq[:, 0]
+
+    nodes = np.zeros(N, dtype=np.int32)
+    active = np.flatnonzero(left[nodes] != -1)
+    while active.shape[0] > 0:
+        nd = nodes[active]
+        f = getDepthDiffs(I, frames[active], x[active], y[active], \
+                          dq[active], theta[:, feature[nd]], shape)
+        nd = np.where(f <= threshold[nd], left[nd], right[nd])
+        nodes[active] = nd
+        active = active[left[nd] != -1]
+
+    return model['leaf'][nodes]
+
+'''
+    The function returns the indices of the offsets in theta that the split
+    nodes of a compiled model read.
+'''
+def getUsedFeatures(model):
+    return np.unique(model['feature'][model['left'] != -1])
+
+'''
+    The function drops the offsets a compiled model never reads from theta.
+    It returns the model with its feature indices remapped and the pruned
+    theta.
+'''
+def pruneModel(model, theta):
+    used = getUsedFeatures(model)
+    pruned = dict(model)
+    pruned['feature'] = np.searchsorted(used, model['feature']).astype(np.int32)
+    return (pruned, theta[:, used])
 
-    return (qm, joint_pred)
+'''
+    The function draws one unit direction per leaf row from the leaf's
+    weights, the same way np.random.choice does. The weights are renormalized
+    since they may be stored with half precision. The draws come from rng, a
+    RandomState, or from the global state by default.
+'''
+def sampleDirections(model, leaves, rng=np.random):
+    cdf = np.cumsum(model['weights'][leaves], axis=1, dtype=float)
+    r = rng.random_sample(leaves.shape[0])[:, np.newaxis]*cdf[:, -1:]
+    idx = np.minimum(np.sum(cdf <= r, axis=1), cdf.shape[1]-1)
+    return model['centers'][leaves, idx]
 
 def getDists(joints, joints_pred):
     assert joints.shape == joints_pred.shape
@@ -254,33 +1072,125 @@ def getDists(joints, joints_pred):
         dists[i] = np.sqrt(np.sum((p1-p2)**2, axis=1))
     return dists
 
-def trainParallel(dataDir, modelsDir, outDir, jointID, theta, I, bodyCenters, \
-                  joints, loadData, loadModels, regressorQ, LQ):
-    S_u, S_f = getSamples(dataDir, outDir, jointID, theta, I, bodyCenters, \
-                                                joints, loadData)
+'''
+    The function saves a compiled model in the model file format, with the
+    node arrays packed, the leaf tables in half precision and only the
+    offsets of theta the model reads. The manifest records the joint name,
+    the indices of these offsets in theta and the walk parameters.
+'''
+def saveModel(path, model, theta, jointID):
+    pruned, thetaUsed = pruneModel(model, theta)
+    arrays = {'feature': pruned['feature'].astype(np.int16),
+              'threshold': pruned['threshold'].astype(np.float32),
+              'left': pruned['left'].astype(np.int32),
+              'right': pruned['right'].astype(np.int32),
+              'leaf': pruned['leaf'].astype(np.int32),
+              'weights': pruned['weights'].astype(np.float16),
+              'centers': pruned['centers'].astype(np.float16),
+              'counts': pruned['counts'].astype(np.int32),
+              'theta': thetaUsed.astype(np.int16)}
+    manifest = {'model': 'rtw', 'jointID': jointID,
+                'jointName': jointName[jointID], 'nFeats': theta.shape[1],
+                'features': getUsedFeatures(model).tolist(), 'K': K,
+                'stepSize': stepSize, 'nSteps': nSteps}
+    modelfile.saveArrays(path, arrays, manifest)
 
-    regressor, L = trainModel(S_f, S_u, jointID, modelsDir, outDir, loadModels)
-    regressorQ.put({jointID: regressor})
-    LQ.put({jointID: L})
+'''
+    The function opens a model file. It returns the compiled model, whose
+    arrays map the file, with feature indices into the full theta, and the
+    4 x nFeats theta rebuilt from the saved offsets (the offsets the model
+    never reads are zero).
+'''
+def loadModel(path):
+    arrays, manifest = modelfile.loadArrays(path)
+    features = np.asarray(manifest['features'], dtype=np.int32)
+    theta = np.zeros((4, manifest['nFeats']), dtype=int)
+    theta[:, features] = arrays['theta']
+
+    model = dict(arrays)
+    del model['theta']
+    if features.shape[0] > 0:
+        model['feature'] = features[arrays['feature']]
+
+    return (model, theta)
+
+'''
+    The function trains the model of one joint in a worker process. The
+    training set is mapped from the files saved in dataDir, so all the workers
+    share the same pages instead of receiving pickled copies. It returns the
+    joint id and the path of the saved compiled model.
+'''
+def trainParallel(args):
+    dataDir, modelsDir, outDir, jointID = args
+    I = np.load(outDir+dataDir+'/I_train.npy', mmap_mode='r')
+    bodyCenters = np.load(outDir+dataDir+'/bodyCenters_train.npy', \
+                          mmap_mode='r')
+    joints = np.load(outDir+dataDir+'/joints_train.npy', mmap_mode='r')
+    theta = np.load(outDir+dataDir+'/theta.npy')
 
+    trainSeries(dataDir, modelsDir, outDir, jointID, theta, I, bodyCenters, \
+                joints[:, jointID])
+
+    return (jointID, outDir+modelsDir+'/model'+str(jointID)+'.rtw')
+
+'''
+    The function returns the key and the parameters of the model of a joint:
+    the samples it is trained on and the training parameters.
+'''
+def getModelKey(dataDir, outDir, jointID):
+    params = {'samples': getSamplesKey(dataDir, outDir, jointID)[0], \
+              'minSamplesLeaf': minSamplesLeaf, 'K': K}
+    return (cache.getKey(params), params)
+
+'''
+    The function returns the model of one joint. A model trained on the same
+    samples with the same parameters is loaded instead of being trained
+    again, and the samples are only generated when a model is trained. A
+    model updated with new people (see updateModels) still stands for the
+    model trained on the base data.
+'''
 def trainSeries(dataDir, modelsDir, outDir, jointID, theta, I, bodyCenters, \
-                joints, loadData, loadModels):
+                joints, nWorkers=1):
+    stage = 'model'+str(jointID)
+    key, params = getModelKey(dataDir, outDir, jointID)
+
+    mkdir(outDir+modelsDir)
+    manifest = cache.readStage(outDir+modelsDir, stage)
+    if manifest is not None and manifest['done'] and \
+            key in (manifest['key'], manifest['params'].get('base')):
+        logger.debug('model %s is up to date', jointName[jointID])
+        model, _ = loadModel(outDir+modelsDir+'/model'+str(jointID)+'.rtw')
+        return model
+
+    cache.writeStage(outDir+modelsDir, stage, key, params, False)
     S_u, S_f = getSamples(dataDir, outDir, jointID, theta, I, bodyCenters, \
-                                                joints, loadData)
-    regressor, L = trainModel(S_f, S_u, jointID, modelsDir, outDir, loadModels)
-    return (regressor, L)
+                                                joints)
+    model = trainModel(S_f, S_u, jointID, modelsDir, outDir, theta, nWorkers, \
+                       getTreePath(dataDir, outDir, jointID))
+    cache.writeStage(outDir+modelsDir, stage, key, params, True)
 
-def main(**kwargs):
+    return model
+
+'''
+    The function sets the joints of the dataset the module works on.
+'''
+def setDataset(ITOP):
     global nJoints
     global jointName
     global C
+
+    nJoints = 15 if ITOP else 12
+    jointName = jointNameITOP if ITOP else jointNameEVAL
+    C = 3.50666662e-3 if ITOP else 3.8605e-3
+
+'''
+    The function runs the whole pipeline and returns the mAP of the test set.
+'''
+def main(**kwargs):
     #depthDir = argv[0] + '/*/joints_depthcoor/*'
     #depthDir = ''#argv[0] #'/mnt0/data/ITOP/out'
     #outDir = ''#argv[1]
 
-    loadData = kwargs.get('loaddata')
-    loadModels = kwargs.get('loadmodels')
-    loadTest = kwargs.get('loadtest')
     dataDir = kwargs.get('data')
     modelsDir = kwargs.get('models')
     ITOP = kwargs.get('itop')
@@ -290,10 +1200,28 @@ def main(**kwargs):
     makePng = kwargs.get('png')
     maxN = kwargs.get('maxn')
     multiThreads = kwargs.get('multithreads')
-
-    nJoints = 15 if ITOP else 12
-    jointName = jointNameITOP if ITOP else jointNameEVAL
-    C = 3.50666662e-3 if ITOP else 3.8605e-3
+    batchWalk = kwargs.get('batch')
+    lazy = kwargs.get('lazy')
+    nWorkers = kwargs.get('nworkers')
+    onePass = kwargs.get('onepass')
+    dagWalk = kwargs.get('dag')
+    pyramid = kwargs.get('pyramid')
+    record = kwargs.get('record', 1)
+    updateDir = kwargs.get('update')
+    seed = kwargs.get('seed')
+    tol = kwargs.get('tol') if kwargs.get('adaptive') else None
+    window = kwargs.get('window')
+
+    setLogFile(outDir)
+
+    # the pyramid walk is a batch walk on two levels, but the DAG walk has
+    # no coarse level, so the two cannot be combined
+    if dagWalk and pyramid:
+        raise ValueError('--dag cannot be combined with --pyramid')
+    walk = 'dag' if dagWalk else 'pyramid' if pyramid else \
+        'batch' if batchWalk else 'serial'
+
+    setDataset(ITOP)
 
     '''
     for i, arg in enumerate(argv[2:]):
@@ -313,48 +1241,58 @@ def main(**kwargs):
     if ITOP:
         I_train, I_test, joints_train, joints_test, theta, bodyCenters_train, \
             bodyCenters_test = getInfoITOP(depthDir, dataDir, outDir, isTop, \
-            maxN, loadData)
+            maxN)
     else:
         I_train, I_test, joints_train, joints_test, theta, bodyCenters_train, \
-            bodyCenters_test = getInfoEVAL(dataDir, outDir, maxN, \
-            loadData)
+            bodyCenters_test = getInfoEVAL(dataDir, outDir, maxN)
 
     nTrain = I_train.shape[0]
     nTest = I_test.shape[0]
 
-    regressors, Ls = {}, {}
-    if not loadTest:
-        logger.debug('\n------- training models -------')
-        if multiThreads:
-            processes = []
-            regressorQ, LQ = Queue(), Queue()
-
-            for i in range(nJoints):
-                p = Process(target=trainParallel, name='Thread #%d' % i, \
-                            args=(dataDir, modelsDir, outDir, i, theta, \
-                            I_train, bodyCenters_train, joints_train[:, i], \
-                            loadData, loadModels, regressorQ, LQ))
-                processes.append(p)
-                p.start()
-
-            regressorsTmp = [regressorQ.get() for p in processes]
-            LsTmp = [LQ.get() for p in processes]
-            regressors = dict(i.items()[0] for i in regressorsTmp)
-            Ls = dict(i.items()[0] for i in LsTmp)
-
-            [p.join() for p in processes]
-        else:
-            for i in range(nJoints):
-                regressors[i], Ls[i] = trainSeries(dataDir, modelsDir, outDir, \
-                                           i, theta, I_train, \
-                                           bodyCenters_train, \
-                                           joints_train[:, i], \
-                                           loadData, loadModels)
+    models = {}
+    logger.debug('\n------- training models -------')
+    if onePass:
+        # generate the samples of all the joints to train in one sweep
+        pending = [i for i in range(nJoints) if not cache.isDone(
+            outDir+modelsDir, 'model'+str(i), \
+            getModelKey(dataDir, outDir, i)[0])]
+        if len(pending) > 0:
+            getSamplesMulti(dataDir, outDir, pending, theta, I_train, \
+                            bodyCenters_train, joints_train[:, pending])
+
+    if multiThreads:
+        pool = Pool(nWorkers)
+        args = [(dataDir, modelsDir, outDir, i) for i in range(nJoints)]
+
+        # collect the models as the joints finish
+        for jointID, modelPath in pool.imap_unordered(trainParallel, args):
+            logger.debug('model %s done', jointName[jointID])
+            models[jointID], _ = loadModel(modelPath)
+
+        pool.close()
+        pool.join()
+    else:
+        for i in range(nJoints):
+            models[i] = trainSeries(dataDir, modelsDir, outDir, i, theta, \
+                                    I_train, bodyCenters_train, \
+                                    joints_train[:, i], nWorkers)
+
+    if updateDir is not None:
+        logger.debug('\n------- updating models -------')
+        update = getUpdateData(updateDir, dataDir, outDir, ITOP, isTop)
+        updateModels(models, dataDir, modelsDir, outDir, theta, update, \
+                     (I_train, joints_train, bodyCenters_train), nWorkers)
+
+    for jointID in range(nJoints):
+        used = getUsedFeatures(models[jointID])
+        logger.debug('model %s - #features used: %d/%d', \
+                     jointName[jointID], used.shape[0], nFeats)
+        np.savetxt(outDir+modelsDir+'/features'+str(jointID)+'.txt', \
+                   used, fmt='%d')
 
     logger.debug('\n------- testing models -------')
-    qms = np.zeros((nTest, nJoints, nSteps+1, 3))
     joints_pred = np.zeros((nTest, nJoints, 3))
-    localErr = np.zeros((nTest, nSteps+1, nJoints, 3))
+    stepsTaken = np.zeros((nTest, nJoints), dtype=int)
     kinemOrder, kinemParent = None, None
 
     if ITOP:
@@ -364,24 +1302,84 @@ def main(**kwargs):
         kinemOrder = kinemOrderEVAL
         kinemParent = kinemParentEVAL
 
-    if loadTest:
-        qms = np.load(outDir+modelsDir+'/qms.npy')
+    # the test walks depend on the data, the models and the walk parameters
+    testParams = {'data': cache.readStage(outDir+dataDir, 'data')['key'], \
+                  'models': [cache.readStage(outDir+modelsDir, \
+                             'model'+str(i))['key'] for i in range(nJoints)], \
+                  'nSteps': nSteps, 'stepSize': stepSize, 'tol': tol, \
+                  'window': window, 'seed': seed, 'walk': walk, \
+                  'pyramid': walk == 'pyramid' and \
+                  [pyramidScale, coarseSteps, fineSteps], 'record': record}
+    testKey = cache.getKey(testParams)
+    testDone = cache.isDone(outDir+modelsDir, 'test', testKey)
+
+    # every record-th position of the walks goes to the paths store as the
+    # walks finish (no paths are kept when record is 0)
+    paths = None
+    pathsPath = outDir+modelsDir+'/paths.npy'
+
+    if not testDone:
+        cache.writeStage(outDir+modelsDir, 'test', testKey, testParams, False)
+        if record:
+            paths = openPaths(pathsPath, nTest, nJoints, nSteps, record)
+        elif os.path.isfile(pathsPath):
+            os.remove(pathsPath)
+    elif record:
+        paths = np.load(pathsPath, mmap_mode='r')
+
+    def keepPath(frames, jointID, qm):
+        if paths is not None:
+            paths[frames, jointID] = encodePaths(qm[..., ::record, :])
+
+    if testDone:
+        logger.debug('test walks are up to date')
         joints_pred = np.load(outDir+modelsDir+'/joints_pred.npy')
-        localErr = np.load(outDir+modelsDir+'/local_err.npy')
+        stepsTaken = np.load(outDir+modelsDir+'/steps.npy')
+    elif dagWalk:
+        predDAG, stepsDAG = testModelsDAG(models, theta, I_test, \
+            bodyCenters_test, kinemOrder, kinemParent, lazy, tol, window, \
+            seed, nWorkers, lambda j, qm: keepPath(slice(None), j, qm))
+        for jointID in kinemOrder:
+            joints_pred[:, jointID] = predDAG[jointID]
+            stepsTaken[:, jointID] = stepsDAG[jointID]
+    elif pyramid:
+        for idx, jointID in enumerate(kinemOrder):
+            logger.debug('testing model %s', jointName[jointID])
+            qm0 = bodyCenters_test if kinemParent[idx] == -1 \
+                else joints_pred[:, kinemParent[idx]]
+            qm, joints_pred[:, jointID], stepsTaken[:, jointID] = \
+                testModelPyramid(models[jointID], theta, qm0, I_test, \
+                                 bodyCenters_test, lazy, tol, window, \
+                                 getJointRng(seed, jointID))
+            keepPath(slice(None), jointID, qm)
+    elif batchWalk:
+        for idx, jointID in enumerate(kinemOrder):
+            logger.debug('testing model %s', jointName[jointID])
+            qm0 = bodyCenters_test if kinemParent[idx] == -1 \
+                else joints_pred[:, kinemParent[idx]]
+            qm, joints_pred[:, jointID], stepsTaken[:, jointID] = \
+                testModelBatch(models[jointID], theta, qm0, I_test, \
+                               bodyCenters_test, lazy, tol, window, \
+                               rng=getJointRng(seed, jointID))
+            keepPath(slice(None), jointID, qm)
     else:
         for idx, jointID in enumerate(kinemOrder):
             logger.debug('testing model %s', jointName[jointID])
+            rng = getJointRng(seed, jointID)
             for i in range(nTest):
                 qm0 = bodyCenters_test[i] if kinemParent[idx] == -1 \
                     else joints_pred[i][kinemParent[idx]]
-                qms[i][jointID], joints_pred[i][jointID] = testModel(
-                    regressors[jointID], Ls[jointID], theta, qm0, I_test[i], \
-                    bodyCenters_test[i])
-                localErr[i, :, jointID, :] = joints_test[i, jointID] - qms[i][jointID]
+                qm, joints_pred[i][jointID], stepsTaken[i][jointID] = \
+                    testModel(models[jointID], theta, qm0, I_test[i], \
+                              bodyCenters_test[i], lazy, tol, window, rng)
+                keepPath(i, jointID, qm)
 
-        np.save(outDir+modelsDir+'/qms', qms)
+    if not testDone:
         np.save(outDir+modelsDir+'/joints_pred', joints_pred)
-        np.save(outDir+modelsDir+'/local_err.npy', localErr)
+        np.save(outDir+modelsDir+'/steps.npy', stepsTaken)
+        if paths is not None:
+            paths.flush()
+        cache.writeStage(outDir+modelsDir, 'test', testKey, testParams, True)
 
     mkdir(outDir+modelsDir+'/pred/')
     for jointID in range(nJoints):
@@ -405,6 +1403,8 @@ def main(**kwargs):
     for i in range(nJoints):
         logger.debug('\nJoint %s:', jointName[i])
         logger.debug('average distance: %f cm', np.mean(dists[:, i]))
+        logger.debug('average #steps: %.1f/%d', np.mean(stepsTaken[:, i]), \
+                     nSteps)
         #logger.debug('average pixel distance: %f', np.mean(distsPixel[:, i]))
         logger.debug('5cm accuracy: %f', np.sum(dists[:, i] < 5)/ \
             float(dists.shape[0]))
@@ -417,19 +1417,19 @@ def main(**kwargs):
 
     # visualize predicted labels
     if not makePng:
-        return
+        return mAP/nJoints
 
     mkdir(outDir+dataDir+'/png/')
     for i in range(nTest):
         pngPath = outDir+dataDir+'/png/'+str(i)+'.png'
-        drawPred(I_test[i], joints_pred[i], qms[i], bodyCenters_test[i], \
-                 pngPath, nJoints, jointName, isTop)
+        drawPred(I_test[i], joints_pred[i], None if paths is None \
+                 else paths[i], bodyCenters_test[i], pngPath, nJoints, \
+                 jointName, isTop)
+
+    return mAP/nJoints
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--loadmodels', action='store_true')
-    parser.add_argument('--loaddata', action='store_true')
-    parser.add_argument('--loadtest', action='store_true')
     parser.add_argument('--models')
     parser.add_argument('--data')
     parser.add_argument('--indir')
@@ -438,6 +1438,18 @@ if __name__ == '__main__':
     parser.add_argument('--top', action='store_true')
     parser.add_argument('--png', action='store_true')
     parser.add_argument('--multithreads', action='store_true')
+    parser.add_argument('--onepass', action='store_true')
+    parser.add_argument('--nworkers', type=int, default=cpu_count())
+    parser.add_argument('--batch', action='store_true')
+    parser.add_argument('--dag', action='store_true')
+    parser.add_argument('--pyramid', action='store_true')
+    parser.add_argument('--update')
+    parser.add_argument('--record', type=int, default=1)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--lazy', action='store_true')
+    parser.add_argument('--adaptive', action='store_true')
+    parser.add_argument('--tol', type=float, default=convTol)
+    parser.add_argument('--window', type=int, default=convWindow)
     parser.add_argument('--maxn', type=int)
     args = parser.parse_args()
     main(**vars(args))
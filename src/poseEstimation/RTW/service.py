@@ -0,0 +1,150 @@
+import time
+import argparse
+import numpy as np
+import rtw
+from helper import *
+
+warmSteps = 60 # the maximum number of steps of a walk from the previous frame
+
+'''
+    The function returns the N x 3 centroids (x, y, depth) of the foreground
+    pixels of the N x H x W depth images I, and a mask of the images that
+    have any foreground.
+'''
+def getForegroundCenters(I):
+    fg = I.reshape(I.shape[0], H*W) != 0
+    counts = np.sum(fg, axis=1)
+    valid = counts > 0
+    counts = np.maximum(counts, 1).astype(float)
+
+    ys, xs = np.divmod(np.arange(H*W), W)
+    centers = np.zeros((I.shape[0], 3))
+    centers[:, 0] = np.dot(fg, xs)/counts
+    centers[:, 1] = np.dot(fg, ys)/counts
+    centers[:, 2] = np.sum(I.reshape(I.shape[0], H*W), axis=1, \
+                           dtype=float)/counts
+
+    return (centers, valid)
+
+'''
+    A PoseService keeps the joint models of a models directory mapped in
+    memory and estimates the joints of the depth frames of one stream as
+    they arrive. The first frame of the stream (or the first after reset) is
+    walked from its foreground centroid in kinematic order for nSteps steps,
+    as in rtw.main. Every later frame starts each joint from its estimate in
+    the previous frame and takes at most warmSteps steps, fewer when budget
+    (seconds per call) would be exceeded at the measured speed. The models are
+    EVAL models unless ITOP is set, as with the --itop flag of rtw.py.
+'''
+class PoseService(object):
+    def __init__(self, modelsPath, ITOP=False, warmSteps=warmSteps, \
+                 budget=None, tol=None, window=rtw.convWindow, lazy=True):
+        self.nJoints = 15 if ITOP else 12
+        self.jointName = jointNameITOP if ITOP else jointNameEVAL
+        self.kinemOrder = kinemOrderITOP if ITOP else kinemOrderEVAL
+        self.kinemParent = kinemParentITOP if ITOP else kinemParentEVAL
+        self.warmSteps = warmSteps
+        self.budget = budget
+        self.tol = tol
+        self.window = window
+        self.lazy = lazy
+
+        self.models, self.thetas = [], []
+        for jointID in range(self.nJoints):
+            model, theta = rtw.loadModel(modelsPath+'/model'+str(jointID)+ \
+                                         '.rtw')
+            self.models.append(model)
+            self.thetas.append(theta)
+        logger.debug('%d models loaded from %s', self.nJoints, modelsPath)
+
+        self.prev = None # the nJoints x 3 joints of the previous frame
+        self.stepTime = None # the seconds per step of one joint walk
+
+    def reset(self):
+        self.prev = None
+
+    '''
+        The method estimates the joints of an H x W depth frame, or of an
+        N x H x W micro-batch of consecutive frames that all start from the
+        estimate of the frame before the batch. It returns the nJoints x 3
+        (or N x nJoints x 3) joints; a frame without foreground gets NaN
+        joints and restarts the stream.
+    '''
+    def estimate(self, I):
+        start = time.time()
+        single = I.ndim == 2
+        if single:
+            I = I[np.newaxis]
+
+        centers, valid = getForegroundCenters(I)
+        joints = np.full((I.shape[0], self.nJoints, 3), np.nan)
+        frames = np.flatnonzero(valid)
+
+        if frames.shape[0] > 0:
+            steps = self.walk(I[frames], centers[frames], joints, frames)
+            self.stepTime = (time.time()-start)/(steps*self.nJoints)
+
+        self.prev = joints[-1] if valid[-1] else None
+
+        return joints[0] if single else joints
+
+    def walk(self, I, centers, joints, frames):
+        N = I.shape[0]
+        est = np.zeros((N, self.nJoints, 3))
+
+        if self.prev is None:
+            steps = rtw.nSteps
+            for idx, jointID in enumerate(self.kinemOrder):
+                qm0 = centers if self.kinemParent[idx] == -1 \
+                    else est[:, self.kinemParent[idx]]
+                _, est[:, jointID], _ = rtw.testModelBatch(
+                    self.models[jointID], self.thetas[jointID], qm0, I, \
+                    centers, self.lazy, self.tol, self.window)
+        else:
+            steps = self.warmSteps
+            if self.budget is not None and self.stepTime is not None:
+                steps = int(self.budget/(self.stepTime*self.nJoints))
+                steps = max(1, min(steps, self.warmSteps))
+            for jointID in range(self.nJoints):
+                qm0 = np.tile(self.prev[jointID], (N, 1))
+                _, est[:, jointID], _ = rtw.testModelBatch(
+                    self.models[jointID], self.thetas[jointID], qm0, I, \
+                    centers, self.lazy, self.tol, self.window, steps)
+
+        joints[frames] = est
+        return steps
+
+'''
+    The function streams the frames of a saved N x H x W depth array (in
+    meters, with the background set to 0, like I_test.npy) through a
+    PoseService in micro-batches and saves the estimated joints.
+'''
+def main(**kwargs):
+    service = PoseService(kwargs.get('models'), kwargs.get('itop'), \
+                          kwargs.get('warmsteps'), kwargs.get('budget'))
+    I = np.load(kwargs.get('input'), mmap_mode='r')
+    batch = kwargs.get('batch')
+
+    joints = np.zeros((I.shape[0], service.nJoints, 3))
+    latency = []
+    for i in range(0, I.shape[0], batch):
+        start = time.time()
+        joints[i:i+batch] = service.estimate(np.asarray(I[i:i+batch]))
+        latency.append(time.time()-start)
+
+    logger.debug('%d frames - first call: %.3f s, average: %.3f s, max: %.3f s', \
+                 I.shape[0], latency[0], np.mean(latency[1:] or latency), \
+                 np.max(latency[1:] or latency))
+    np.save(kwargs.get('output'), joints)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models')
+    parser.add_argument('--input')
+    parser.add_argument('--output')
+    parser.add_argument('--itop', action='store_true')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--warmsteps', type=int, default=warmSteps)
+    parser.add_argument('--budget', type=float)
+    args = parser.parse_args()
+    main(**vars(args))
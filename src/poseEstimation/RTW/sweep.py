@@ -0,0 +1,169 @@
+import time
+import json
+import itertools
+import argparse
+import numpy as np
+import rtw
+import cache
+from helper import *
+from multiprocessing import Pool, cpu_count
+
+sweepParams = ['minSamplesLeaf', 'K', 'nSteps', 'stepSize', 'nSamps']
+defaults = dict([(name, getattr(rtw, name)) for name in sweepParams])
+
+'''
+    The function returns the configurations of a grid, a dict from parameter
+    names to lists of values, as a list of dicts.
+'''
+def getGrid(grid):
+    names = sorted(grid.keys())
+    return [dict(zip(names, values)) \
+            for values in itertools.product(*[grid[name] for name in names])]
+
+'''
+    The function sets the parameters of rtw to a configuration, and the
+    parameters the configuration leaves out to their defaults.
+'''
+def setConfig(config):
+    for name in sweepParams:
+        setattr(rtw, name, config.get(name, defaults[name]))
+
+def getConfigName(config):
+    return '_'.join([name+str(config[name]) for name in sorted(config.keys())])
+
+def loadData(kwargs, dataDir):
+    if kwargs['itop']:
+        return rtw.getInfoITOP(kwargs['indir'], dataDir, kwargs['outdir'], \
+                               kwargs['top'], kwargs['maxn'])
+    return rtw.getInfoEVAL(dataDir, kwargs['outdir'], kwargs['maxn'])
+
+'''
+    The function generates the samples of all the joints for the nSamps of a
+    configuration, in one sweep over the training images. The data is loaded
+    from its stage, which main prepares before the sweep.
+'''
+def prepareSamples(args):
+    kwargs, config = args
+    setConfig(config)
+    rtw.setDataset(kwargs['itop'])
+    dataDir, outDir = kwargs['data'], kwargs['outdir']
+
+    I_train, _, joints_train, _, theta, bodyCenters_train, _ = \
+        loadData(kwargs, dataDir)
+    pending = [i for i in range(rtw.nJoints) if not cache.isDone( \
+               rtw.getSamplesDir(dataDir, outDir), 'samples'+str(i), \
+               rtw.getSamplesKey(dataDir, outDir, i)[0])]
+    if len(pending) > 0:
+        rtw.getSamplesMulti(dataDir, outDir, pending, theta, I_train, \
+                            bodyCenters_train, joints_train[:, pending])
+
+'''
+    The function fits the tree of one joint for the nSamps and the
+    minSamplesLeaf of a configuration, unless it is already saved.
+'''
+def prepareTree(args):
+    kwargs, config, jointID = args
+    setConfig(config)
+    rtw.setDataset(kwargs['itop'])
+    dataDir, outDir = kwargs['data'], kwargs['outdir']
+
+    treePath = rtw.getTreePath(dataDir, outDir, jointID)
+    if not os.path.isfile(treePath):
+        I = np.load(outDir+dataDir+'/I_train.npy', mmap_mode='r')
+        bodyCenters = np.load(outDir+dataDir+'/bodyCenters_train.npy')
+        joints = np.load(outDir+dataDir+'/joints_train.npy')
+        theta = np.load(outDir+dataDir+'/theta.npy')
+        S_u, S_f = rtw.getSamples(dataDir, outDir, jointID, theta, I, \
+                                  bodyCenters, joints[:, jointID])
+        rtw.fitTree(S_f, S_u, jointID, treePath)
+
+'''
+    The function trains and tests a configuration in its own models
+    directory. It returns the configuration, its mAP and its run time.
+'''
+def runConfig(args):
+    kwargs, config = args
+    setConfig(config)
+
+    start = time.time()
+    mAP = rtw.main(**dict(kwargs, \
+        models=kwargs['models']+'/'+getConfigName(config)))
+
+    return (config, mAP, time.time()-start)
+
+'''
+    The function runs the configurations of a grid (--grid, a JSON dict of
+    value lists) or of a list (--configs, a JSON file holding a list of
+    dicts) in a pool of nWorkers processes. The data and theta are loaded
+    once for all the configurations, the samples are generated once
+    per nSamps and the trees once per nSamps and minSamplesLeaf, before the
+    configurations are trained (only their leaves, when just K differs) and
+    tested. It writes the table of the mAP and the run time of every
+    configuration to sweep.txt in the models directory.
+'''
+def main(**kwargs):
+    if kwargs.get('grid') is not None:
+        configs = getGrid(json.loads(kwargs.get('grid')))
+    else:
+        with open(kwargs.get('configs')) as f:
+            configs = json.load(f)
+    for config in configs:
+        for name in config.keys():
+            if name not in sweepParams:
+                raise ValueError('cannot sweep %s' % name)
+    setLogFile(kwargs['outdir'])
+
+    nWorkers = kwargs.pop('nworkers')
+    kwargs = dict(kwargs, png=False, multithreads=False, nworkers=1)
+    pool = Pool(nWorkers)
+
+    logger.debug('\n------- sweep: data -------')
+    rtw.setDataset(kwargs['itop'])
+    loadData(kwargs, kwargs['data'])
+
+    logger.debug('\n------- sweep: samples -------')
+    groups = dict([(config.get('nSamps', defaults['nSamps']), config) \
+                   for config in configs])
+    pool.map(prepareSamples, [(kwargs, config) for config in groups.values()])
+
+    logger.debug('\n------- sweep: trees -------')
+    nJoints = 15 if kwargs['itop'] else 12
+    trees = dict([((config.get('nSamps', defaults['nSamps']), \
+                    config.get('minSamplesLeaf')), config) \
+                  for config in configs])
+    pool.map(prepareTree, [(kwargs, config, jointID) \
+                           for config in trees.values() \
+                           for jointID in range(nJoints)])
+
+    logger.debug('\n------- sweep: configurations -------')
+    results = pool.map(runConfig, [(kwargs, config) for config in configs])
+    pool.close()
+    pool.join()
+
+    mkdir(kwargs['outdir']+kwargs['models'])
+    with open(kwargs['outdir']+kwargs['models']+'/sweep.txt', 'w') as f:
+        f.write('\t'.join(sweepParams+['mAP', 'seconds'])+'\n')
+        for config, mAP, seconds in results:
+            values = [str(config.get(name, defaults[name])) \
+                      for name in sweepParams]
+            f.write('\t'.join(values+['%.4f' % mAP, '%.1f' % seconds])+'\n')
+            logger.debug('%s - mAP (10cm): %f, %.1f s', getConfigName(config), \
+                         mAP, seconds)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grid')
+    parser.add_argument('--configs')
+    parser.add_argument('--models')
+    parser.add_argument('--data')
+    parser.add_argument('--indir')
+    parser.add_argument('--outdir')
+    parser.add_argument('--itop', action='store_true')
+    parser.add_argument('--top', action='store_true')
+    parser.add_argument('--maxn', type=int)
+    parser.add_argument('--nworkers', type=int, default=cpu_count())
+    parser.add_argument('--batch', action='store_true')
+    parser.add_argument('--lazy', action='store_true')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    main(**vars(args))
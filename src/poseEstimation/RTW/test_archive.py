@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import archive
+
+'''
+    The function writes the text files of a frame of person 0 in dataDir, in
+    the format of the ITOP dumps, and returns its arrays by stream.
+'''
+def writeFrame(dataDir, frame, rng):
+    arrays = {}
+    for stream in archive.streams:
+        path = '%s/00_%05d_%s.txt' % (dataDir, frame, stream)
+        if stream.startswith('joints'):
+            arrays[stream] = np.round(rng.uniform(-1000, 1000, (15, 5)), 6)
+            np.savetxt(path, arrays[stream], fmt='%f', delimiter=', ')
+        elif stream.startswith('label'):
+            arrays[stream] = rng.randint(-1, 3, (archive.H, archive.W))
+            np.savetxt(path, arrays[stream], fmt='%d')
+        else:
+            arrays[stream] = np.round(rng.uniform(0, 4, \
+                                      (archive.H, archive.W)), 6)
+            np.savetxt(path, arrays[stream], fmt='%f')
+    return arrays
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.dataDir = tempfile.mkdtemp()
+        self.archiveDir = tempfile.mkdtemp()
+        self.rng = np.random.RandomState(0)
+        self.frames = dict([(frame, writeFrame(self.dataDir, frame, self.rng)) \
+                            for frame in [0, 1, 3]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dataDir)
+        shutil.rmtree(self.archiveDir)
+
+    def checkArchive(self):
+        index, arrays = archive.loadArchive(self.archiveDir, 0)
+        np.testing.assert_array_equal(index, sorted(self.frames.keys()))
+        for row, frame in enumerate(index):
+            for stream in archive.streams:
+                np.testing.assert_array_equal(arrays[stream][row], \
+                                              self.frames[frame][stream])
+
+    def testParity(self):
+        self.assertEqual(archive.convertPerson((self.dataDir, \
+                         self.archiveDir, 0)), (0, 3, 3))
+        self.checkArchive()
+
+    def testNewFrames(self):
+        archive.convertPerson((self.dataDir, self.archiveDir, 0))
+        self.assertEqual(archive.convertPerson((self.dataDir, \
+                         self.archiveDir, 0)), (0, 3, 0))
+
+        self.frames[2] = writeFrame(self.dataDir, 2, self.rng)
+        self.assertEqual(archive.convertPerson((self.dataDir, \
+                         self.archiveDir, 0)), (0, 4, 1))
+        self.checkArchive()
+
+    def testFindFrames(self):
+        archive.convertPerson((self.dataDir, self.archiveDir, 0))
+        index, _ = archive.loadArchive(self.archiveDir, 0)
+        np.testing.assert_array_equal(archive.findFrames(index, \
+                                      [3, 2, 0, 7]), [2, -1, 0, -1])
+        np.testing.assert_array_equal(archive.findFrames(np.zeros(0, int), \
+                                      [1, 2]), [-1, -1])
+
+if __name__ == '__main__':
+    unittest.main()
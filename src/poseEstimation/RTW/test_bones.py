@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import bones
+
+'''
+    The function returns the squared distance of the point p to the segment
+    from a to b.
+'''
+def segmentDist2(p, a, b):
+    d = b-a
+    if np.dot(d, d) == 0:
+        return np.dot(p-a, p-a)
+    t = np.clip(np.dot(p-a, d)/np.dot(d, d), 0, 1)
+    return np.dot(p-a-t*d, p-a-t*d)
+
+class NearestSegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def check(self, pts, seg1, seg2, frames, chunk):
+        nearest = bones.nearestSegment(pts, seg1, seg2, frames, chunk)
+        for p, i, s in zip(pts, frames, nearest):
+            dists = [segmentDist2(p, a, b) for a, b in zip(seg1[i], seg2[i])]
+            self.assertAlmostEqual(dists[s], min(dists))
+
+    def testFrames(self):
+        seg1 = self.rng.uniform(0, 100, (3, 8, 3))
+        seg2 = self.rng.uniform(0, 100, (3, 8, 3))
+        pts = self.rng.uniform(-20, 120, (500, 3))
+        self.check(pts, seg1, seg2, self.rng.randint(0, 3, 500), 64)
+
+    def testPointSegment(self):
+        seg1 = np.array([[[0., 0, 0], [10, 0, 0]]])
+        seg2 = np.array([[[0., 0, 0], [10, 10, 0]]])
+        pts = np.array([[1., 0, 0], [9, 5, 0], [-1, -1, 0]])
+        np.testing.assert_array_equal(bones.nearestSegment(pts, seg1, seg2), \
+                                      [0, 1, 0])
+
+    def testSegments(self):
+        joints = self.rng.uniform(0, 100, (2, 4, 3))
+        seg1, seg2, labels = bones.getSegments(joints, [(0, 1), (1, 2), \
+                                               (2, 3)], [0.5, 0.25, 1.0])
+        self.assertEqual(seg1.shape, (2, 6, 3))
+        np.testing.assert_array_equal(labels, [0, 1, 2, 1, 2, 3])
+        np.testing.assert_allclose(seg1[:, 3], seg2[:, 0])
+        np.testing.assert_allclose(seg2[:, 4], joints[:, 2])
+        np.testing.assert_allclose(seg1[:, 4], \
+                                   0.75*joints[:, 1]+0.25*joints[:, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import time
+import unittest
+import numpy as np
+import rtw
+import cache
+from test_rtw import StageTest, makeImages, makeTheta
+from helper import H, W
+
+class CacheTest(StageTest):
+    def testKey(self):
+        self.assertEqual(cache.getKey({'a': 1, 'b': [2, 3]}), \
+                         cache.getKey({'b': [2, 3], 'a': 1}))
+        self.assertNotEqual(cache.getKey({'a': 1}), cache.getKey({'a': 2}))
+
+    def testFileStamps(self):
+        path = self.outDir+'f.txt'
+        with open(path, 'w') as f:
+            f.write('abc')
+        stamps = cache.fileStamps([path])
+        self.assertEqual(cache.fileStamps([path]), stamps)
+
+        with open(path, 'w') as f:
+            f.write('abcd')
+        self.assertNotEqual(cache.fileStamps([path]), stamps)
+
+    def testStages(self):
+        self.assertIsNone(cache.readStage(self.outDir, 's'))
+        self.assertFalse(cache.isDone(self.outDir, 's', 'k'))
+
+        cache.writeStage(self.outDir, 's', 'k', {'a': 1}, False)
+        self.assertFalse(cache.isDone(self.outDir, 's', 'k'))
+        cache.writeStage(self.outDir, 's', 'k', {'a': 1}, True)
+        self.assertTrue(cache.isDone(self.outDir, 's', 'k'))
+        self.assertFalse(cache.isDone(self.outDir, 's', 'other'))
+        self.assertEqual(cache.readStage(self.outDir, 's')['params'], \
+                         {'a': 1})
+        self.assertEqual(sorted(os.listdir(self.outDir)), ['s.json'])
+
+    def testFinishedStageNotRewritten(self):
+        cache.writeStage(self.outDir, 's', 'k', {}, True)
+        mtime = os.path.getmtime(self.outDir+'s.json')
+        time.sleep(0.01)
+        cache.writeStage(self.outDir, 's', 'k', {}, True)
+        self.assertEqual(os.path.getmtime(self.outDir+'s.json'), mtime)
+
+class DataStageTest(StageTest):
+    def setUp(self):
+        StageTest.setUp(self)
+        rng = np.random.RandomState(5)
+        rtw.mkdir(self.outDir+'data')
+        np.save(self.outDir+'data/I.npy', makeImages(rng, 4))
+        np.save(self.outDir+'data/I_mask.npy', np.ones((4, H, W)))
+        np.save(self.outDir+'data/joints.npy', rng.uniform(0, H, (4, 12, 3)))
+        rtw.setDataset(False)
+
+    def getKeys(self):
+        return (cache.readStage(self.outDir+'data', 'data')['key'], \
+                rtw.getSamplesKey('data', self.outDir, 0)[0])
+
+    def testReuse(self):
+        theta = rtw.getInfoEVAL('data', self.outDir)[4]
+        keys = self.getKeys()
+        np.testing.assert_array_equal(rtw.getInfoEVAL('data', \
+                                                      self.outDir)[4], theta)
+        self.assertEqual(self.getKeys(), keys)
+
+    def testChangedFiles(self):
+        rtw.getInfoEVAL('data', self.outDir)
+        dataKey, samplesKey = self.getKeys()
+        np.save(self.outDir+'data/joints.npy', np.zeros((3, 12, 3)))
+        rtw.getInfoEVAL('data', self.outDir)
+        self.assertNotEqual(self.getKeys()[0], dataKey)
+        self.assertNotEqual(self.getKeys()[1], samplesKey)
+
+    def testRedrawnTheta(self):
+        rtw.getInfoEVAL('data', self.outDir)
+        dataKey, samplesKey = self.getKeys()
+        np.save(self.outDir+'data/theta.npy', \
+                makeTheta(np.random.RandomState(6), rtw.nFeats))
+        self.assertEqual(self.getKeys()[0], dataKey)
+        self.assertNotEqual(self.getKeys()[1], samplesKey)
+
+if __name__ == '__main__':
+    unittest.main()
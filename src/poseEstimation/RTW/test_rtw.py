@@ -0,0 +1,283 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import rtw
+import cache
+from helper import H, W
+from sklearn.tree import DecisionTreeRegressor
+
+'''
+    The tests check the batched engines of rtw against the per-point
+    computations they replace. Run them from this directory with
+    python -m unittest discover -p 'test_*.py'
+'''
+
+'''
+    The function returns N random depth images with background (0) holes.
+    The depths are multiples of 1/4, so float32 holds them exactly.
+'''
+def makeImages(rng, N):
+    I = rng.randint(4, 16, (N, H, W))/4.0
+    I[rng.rand(N, H, W) < 0.3] = 0
+    return I
+
+def makeTheta(rng, nFeats):
+    return rng.randint(-rtw.maxOffFeat, rtw.maxOffFeat+1, (4, nFeats))
+
+'''
+    The function is the per-point feature computation of the first rtw: the
+    query point q of img, at the depth z when it falls on the background.
+'''
+def getFeaturesRef(img, theta, q, z):
+    img = img.copy()
+    img[img == 0] = rtw.largeNum
+    coor = np.rint([np.clip(q[1], 0, H-1), np.clip(q[0], 0, W-1)]).astype(int)
+    dq = z if img[tuple(coor)] == rtw.largeNum else img[tuple(coor)]
+
+    x1 = np.clip(coor[1]+theta[0]/dq, 0, W-1).astype(int)
+    y1 = np.clip(coor[0]+theta[1]/dq, 0, H-1).astype(int)
+    x2 = np.clip(coor[1]+theta[2]/dq, 0, W-1).astype(int)
+    y2 = np.clip(coor[0]+theta[3]/dq, 0, H-1).astype(int)
+
+    return img[y1, x1] - img[y2, x2]
+
+'''
+    The function returns N x M query points, some of them off the image.
+'''
+def makeQueries(rng, N, M):
+    qs = np.zeros((N, M, 3))
+    qs[:, :, 0] = rng.uniform(-20, W+20, (N, M))
+    qs[:, :, 1] = rng.uniform(-20, H+20, (N, M))
+    return qs
+
+class FeaturesTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.I = makeImages(self.rng, 3)
+        self.theta = makeTheta(self.rng, 50)
+        self.z = np.array([2.0, 2.5, 3.25])
+
+    def testBatchMatchesReference(self):
+        qs = makeQueries(self.rng, 3, 20)
+        F = rtw.getFeaturesBatch(self.I, self.theta, qs, self.z)
+
+        self.assertEqual(F.shape, (3, 20, 50))
+        for n in range(3):
+            for m in range(20):
+                np.testing.assert_array_equal(F[n, m], getFeaturesRef( \
+                    self.I[n], self.theta, qs[n, m], self.z[n]))
+
+    def testFrames(self):
+        qs = makeQueries(self.rng, 4, 5)
+        frames = np.array([2, 0, 2, 1])
+        F = rtw.getFeaturesBatch(self.I, self.theta, qs, self.z[frames], \
+                                 frames)
+
+        for n in range(4):
+            for m in range(5):
+                np.testing.assert_array_equal(F[n, m], getFeaturesRef( \
+                    self.I[frames[n]], self.theta, qs[n, m], \
+                    self.z[frames[n]]))
+
+    def testSinglePoint(self):
+        q = np.array([100.4, 50.6, 0])
+        np.testing.assert_array_equal( \
+            rtw.getFeatures(self.I[1], self.theta, q, self.z[1]), \
+            getFeaturesRef(self.I[1], self.theta, q, self.z[1]))
+
+    def testInputsUnchanged(self):
+        I, qs = self.I.copy(), makeQueries(self.rng, 3, 4)
+        qsCopy = qs.copy()
+        rtw.getFeaturesBatch(self.I, self.theta, qs, self.z)
+        np.testing.assert_array_equal(self.I, I)
+        np.testing.assert_array_equal(qs, qsCopy)
+
+'''
+    The function fits a small regression tree on X and returns it with its
+    compiled form.
+'''
+def fitCompiled(rng, X):
+    regressor = DecisionTreeRegressor(min_samples_leaf=5, random_state=0)
+    regressor.fit(X, rng.randn(X.shape[0], 3))
+    return (regressor, rtw.compileTree(regressor))
+
+class ApplyModelTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(1)
+        self.X = self.rng.randn(400, 30).astype(np.float32)
+        self.regressor, self.tree = fitCompiled(self.rng, self.X)
+
+    def testMatchesSklearn(self):
+        X = np.concatenate((self.X, self.rng.randn(100, 30)))
+        expected = self.tree['leaf'][self.regressor.apply( \
+            X.astype(np.float32))]
+
+        np.testing.assert_array_equal(rtw.applyModel(self.tree, X), expected)
+        for x, leaf in zip(X[:20], expected):
+            self.assertEqual(rtw.applyModel(self.tree, x), leaf)
+
+    def testLeafRows(self):
+        leaves = rtw.applyModel(self.tree, self.X)
+        nLeaves = np.max(self.tree['leaf'])+1
+        self.assertEqual(np.unique(leaves).shape[0], nLeaves)
+        self.assertEqual(nLeaves, \
+                         np.sum(self.regressor.tree_.children_left == -1))
+
+class ApplyModelLazyTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(2)
+        self.I = makeImages(self.rng, 4)
+        self.theta = makeTheta(self.rng, 40)
+        self.z = np.array([2.0, 2.5, 3.25, 1.75])
+
+        qs = makeQueries(self.rng, 4, 100)
+        X = rtw.getFeaturesBatch(self.I, self.theta, qs, self.z)
+        _, self.tree = fitCompiled(self.rng, X.reshape(-1, 40))
+
+    def testBatchMatchesApplyModel(self):
+        q = makeQueries(self.rng, 4, 1)
+        expected = rtw.applyModel(self.tree, rtw.getFeaturesBatch( \
+            self.I, self.theta, q, self.z)[:, 0])
+        np.testing.assert_array_equal(rtw.applyModelLazy(self.tree, \
+            self.theta, self.I, q[:, 0], self.z), expected)
+
+    def testFrames(self):
+        q = makeQueries(self.rng, 60, 1)
+        frames = self.rng.randint(0, 4, 60)
+        expected = rtw.applyModel(self.tree, rtw.getFeaturesBatch( \
+            self.I, self.theta, q, self.z[frames], frames)[:, 0])
+        np.testing.assert_array_equal(rtw.applyModelLazy(self.tree, \
+            self.theta, self.I, q[:, 0], self.z[frames], frames), expected)
+
+    def testSingleImage(self):
+        for q in makeQueries(self.rng, 1, 30)[0]:
+            expected = rtw.applyModel(self.tree, rtw.getFeatures( \
+                self.I[2], self.theta, q, self.z[2]))
+            self.assertEqual(rtw.applyModelLazy(self.tree, self.theta, \
+                self.I[2], q, self.z[2]), expected)
+
+'''
+    The base of the tests that need an output directory with the data stages
+    of rtw. The rtw parameters a test changes are restored after it.
+'''
+class StageTest(unittest.TestCase):
+    params = {}
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()+'/'
+        self.saved = dict([(name, getattr(rtw, name)) \
+                           for name in self.params])
+        for name, value in self.params.items():
+            setattr(rtw, name, value)
+        rtw.setDataset(True)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(rtw, name, value)
+        shutil.rmtree(self.outDir)
+
+    def makeData(self, dataDir, theta):
+        rtw.mkdir(self.outDir+dataDir)
+        cache.writeStage(self.outDir+dataDir, 'data', 'data', {}, True)
+        np.save(self.outDir+dataDir+'/theta', theta)
+
+class SampleStoreTest(StageTest):
+    params = {'nSamps': 20, 'featChunk': 2}
+
+    def setUp(self):
+        StageTest.setUp(self)
+        rng = np.random.RandomState(3)
+        self.I = makeImages(rng, 7)
+        self.theta = makeTheta(rng, rtw.nFeats)
+        self.bodyCenters = np.array([[W/2, H/2, 2.5]]*7)
+        self.joints = np.column_stack((rng.uniform(0, W, 7), \
+                                       rng.uniform(0, H, 7), np.ones(7)))
+        for dataDir in ['full', 'resumed']:
+            self.makeData(dataDir, self.theta)
+
+    def getSamples(self, dataDir, n):
+        S_u, S_f = rtw.getSamples(dataDir, self.outDir, 0, self.theta, \
+            self.I[:n], self.bodyCenters[:n], self.joints[:n])
+        return (np.array(S_u), np.array(S_f))
+
+    def testResume(self):
+        np.random.seed(0)
+        S_u, S_f = self.getSamples('full', 7)
+        self.assertEqual(S_f.shape, (S_u.shape[0], rtw.nFeats))
+        self.assertFalse(np.any(np.all(S_f == 0, axis=1)))
+
+        # stop after 2 chunks, with a partly written third chunk
+        np.random.seed(0)
+        self.getSamples('resumed', 4)
+        samplesDir = rtw.getSamplesDir('resumed', self.outDir)
+        for name in ['su0.dat', 'sf0.dat']:
+            with open(samplesDir+'/'+name, 'ab') as f:
+                f.write('\0'*100)
+
+        S_u2, S_f2 = self.getSamples('resumed', 7)
+        np.testing.assert_array_equal(S_u2, S_u)
+        np.testing.assert_array_equal(S_f2, S_f)
+
+    def testReuse(self):
+        S_u, S_f = self.getSamples('full', 7)
+        S_u2, S_f2 = self.getSamples('full', 7)
+        np.testing.assert_array_equal(S_u2, S_u)
+        np.testing.assert_array_equal(S_f2, S_f)
+
+    def testOtherKey(self):
+        S_u, _ = self.getSamples('full', 7)
+        rtw.maxOffSampXY += 1
+        try:
+            S_u2, _ = self.getSamples('full', 7)
+        finally:
+            rtw.maxOffSampXY -= 1
+        self.assertFalse(S_u2.shape == S_u.shape and \
+                         np.array_equal(S_u2, S_u))
+
+class ModelFileTest(StageTest):
+    params = {'nSamps': 200, 'minSamplesLeaf': 100, 'K': 5, 'nSteps': 20}
+
+    def setUp(self):
+        StageTest.setUp(self)
+        rng = np.random.RandomState(4)
+        self.I = makeImages(rng, 6)
+        self.theta = makeTheta(rng, rtw.nFeats)
+        self.bodyCenters = np.array([[W/2, H/2, 2.5]]*6)
+        self.joints = np.column_stack((rng.uniform(0, W, 6), \
+                                       rng.uniform(0, H, 6), np.ones(6)))
+        self.makeData('data', self.theta)
+
+    def trainSeries(self):
+        return rtw.trainSeries('data', 'models', self.outDir, 0, self.theta, \
+            self.I, self.bodyCenters, self.joints)
+
+    def walk(self, model):
+        return rtw.testModelBatch(model, self.theta, self.bodyCenters, \
+            self.I, self.bodyCenters, rng=np.random.RandomState(0))[1]
+
+    def testRoundTrip(self):
+        S_u, S_f = rtw.getSamples('data', self.outDir, 0, self.theta, \
+            self.I, self.bodyCenters, self.joints)
+        tree, leaves = rtw.fitTree(S_f, S_u, 0)
+        model = rtw.compileModel(tree, rtw.stochastic(leaves, S_u), leaves)
+        path = self.outDir+'model.rtw'
+        rtw.saveModel(path, model, self.theta, 0)
+        loaded, theta = rtw.loadModel(path)
+
+        np.testing.assert_array_equal(rtw.applyModel(loaded, S_f), leaves)
+        for name in ['weights', 'centers']:
+            self.assertEqual(loaded[name].dtype, np.float16)
+            np.testing.assert_array_equal(loaded[name], \
+                                          model[name].astype(np.float16))
+        used = rtw.getUsedFeatures(model)
+        np.testing.assert_array_equal(theta[:, used], self.theta[:, used])
+
+    def testFreshAndCachedWalksAgree(self):
+        fresh = self.walk(self.trainSeries())
+        cached = self.walk(self.trainSeries())
+        np.testing.assert_array_equal(fresh, cached)
+
+if __name__ == '__main__':
+    unittest.main()
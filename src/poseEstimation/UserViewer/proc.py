@@ -4,7 +4,11 @@ import glob
 import cv2
 import sys
 import os
-from sklearn.neighbors import KNeighborsClassifier
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                             '..', 'RTW'))
+import bones
+import archive
+from multiprocessing import Pool, cpu_count
 np.set_printoptions(threshold=np.nan)
 
 ''' order:
@@ -30,7 +34,6 @@ W = 320
 nJoints = 15
 nPeople = 20
 ptsPerJoint = 20
-nNeighbors = 5
 
 palette = [(34, 69, 101), (0, 195, 243), (146, 86, 135), (130, 132, 132),\
            (0, 132, 243), (241, 202, 161), (50, 0, 190), (128, 178, 194), \
@@ -48,6 +51,16 @@ skeleton = [(0,1), (1,2), (1,3), (2,4), (3,5), (4,6), (5,7), (2,8), (3,8), \
 # first joint vs second joint
 relativeWeights = [0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.2, \
                    0.2, 0.8, 0.8, 0.5, 0.5, 0.5, 0.5, 0.5]
+# the corners of the torso (top left, top right, bottom left, bottom right)
+# follow the joints
+torsoSkel = [(15,16), (16,18), (18,17), (17,15)]
+boneWeights = relativeWeights+[0.5]*len(torsoSkel)
+boneLabels = skeleton+[(8,8)]*len(torsoSkel) # the torso is TORSO
+
+# the per-frame fields of a quality index (see getFrameQuality)
+qualityFields = [('frame', int), ('valid', bool), ('jointsSide', int), \
+                 ('jointsTop', int), ('label', int), ('fgSide', int), \
+                 ('fgTop', int), ('C', float), ('size', int), ('mtime', float)]
 
 '''
     pixelZ = worldZ
@@ -126,107 +139,45 @@ def drawJoints(img, joints, bad):
 
     return img
 
-def x2yz(pt1, pt2, x):
-    y = (x-pt1[0])/(pt2[0]-pt1[0])*(pt2[1]-pt1[1])+pt1[1]
-    z = (x-pt1[0])/(pt2[0]-pt1[0])*(pt2[2]-pt1[2])+pt1[2]
-    return (np.round(y).astype(int), np.round(z).astype(int))
-
-def y2xz(pt1, pt2, y):
-    x = (y-pt1[1])/(pt2[1]-pt1[1])*(pt2[0]-pt1[0])+pt1[0]
-    z = (y-pt1[1])/(pt2[1]-pt1[1])*(pt2[2]-pt1[2])+pt1[2]
-    return (np.round(x).astype(int), np.round(z).astype(int))
+# appends the corners of the torso to N x nJoints x 3 joints
+def addTorso(joints):
+    tl = joints[:, 2]*(1-relativeWeights[7])+joints[:, 8]*relativeWeights[7]
+    tr = joints[:, 3]*(1-relativeWeights[8])+joints[:, 8]*relativeWeights[8]
+    bl = joints[:, 8]*(1-relativeWeights[9])+joints[:, 9]*relativeWeights[9]
+    br = joints[:, 8]*(1-relativeWeights[10])+joints[:, 10]*relativeWeights[10]
+    return np.concatenate((joints, np.stack((tl, tr, bl, br), axis=1)), axis=1)
 
+'''
+    The function returns the points sampled along the bones of the skeleton
+    of joints and around the torso, in world coordinates rounded in the
+    interpolated axes, and their joint labels.
+'''
 def joints2skeleton(joints):
-    ptsAll = np.array([]).reshape(0, 3)
-    labelsAll = np.array([]).reshape(0)
-
-    for i, jointPair in enumerate(skeleton):
-        x, y, z, nPts = None, None, None, 0
-        pt1 = joints[jointPair[0]]
-        pt2 = joints[jointPair[1]]
-
-        idx, nPts = 0, 0
-        if abs(pt1[0]-pt2[0]) < abs(pt1[1]-pt2[1]):
-            idx = 1
+    pts, labels = bones.sampleSkeleton(addTorso(joints[np.newaxis]), \
+        skeleton+torsoSkel, ptsPerJoint, boneWeights, boneLabels, rounded=True)
+    valid = labels[0] >= 0
+    return (pts[0][valid], labels[0][valid])
 
-        start = min(pt1[idx], pt2[idx])
-        end = max(pt1[idx], pt2[idx])
-        if idx == 1:
-            y = np.arange(start, end, (end-start)/ptsPerJoint)
-            x, z = y2xz(pt1, pt2, y)
-            nPts = y.shape[0]
-        else:
-            x = np.arange(start, end, (end-start)/ptsPerJoint)
-            y, z = x2yz(pt1, pt2, x)
-            nPts = x.shape[0]
-        if nPts == 0:
-            continue
-        labels = np.empty(nPts)
-        nPart1 = int(relativeWeights[i]*nPts)
-        nPart2 = nPts - nPart1
-        nParts = [nPart1, nPart2]
-        idxSm = np.argmin([pt1[idx], pt2[idx]])
-        idxLg = np.argmax([pt1[idx], pt2[idx]])
-        labels[:nParts[idxSm]] = jointPair[idxSm]
-        labels[nParts[idxSm]:] = jointPair[idxLg]
-
-        pts = np.vstack((x, y, z)).T
-        ptsAll = np.concatenate((ptsAll, pts))
-        #print ptsAll.shape
-        labelsAll = np.concatenate((labelsAll, labels))
-        #print labelsAll.shape
-
-    # torso
-    tl = joints[2]*(1-relativeWeights[7])+joints[8]*relativeWeights[7]
-    tr = joints[3]*(1-relativeWeights[8])+joints[8]*relativeWeights[8]
-    bl = joints[8]*(1-relativeWeights[9])+joints[9]*relativeWeights[9]
-    br = joints[8]*(1-relativeWeights[10])+joints[10]*relativeWeights[10]
-
-    torsoSkel = [(tl, tr), (tr, br), (br, bl), (bl, tl)]
-    for i, jointPair in enumerate(torsoSkel):
-        x, y, z, nPts = None, None, None, 0
-        pt1 = torsoSkel[i][0]
-        pt2 = torsoSkel[i][1]
-
-        idx, nPts = 0, 0
-        if abs(pt1[0]-pt2[0]) < abs(pt1[1]-pt2[1]):
-            idx = 1
-
-        start = min(pt1[idx], pt2[idx])
-        end = max(pt1[idx], pt2[idx])
-        if idx == 1:
-            y = np.arange(start, end, (end-start)/ptsPerJoint)
-            x, z = y2xz(pt1, pt2, y)
-            nPts = y.shape[0]
-        else:
-            x = np.arange(start, end, (end-start)/ptsPerJoint)
-            y, z = x2yz(pt1, pt2, x)
-            nPts = x.shape[0]
-        if nPts == 0:
-            continue
-
-        labels = 8*np.ones(nPts)
-        pts = np.vstack((x, y, z)).T
-        ptsAll = np.concatenate((ptsAll, pts))
-        #print ptsAll.shape
-        labelsAll = np.concatenate((labelsAll, labels))
-        #print labelsAll.shape
-
-    return (ptsAll, labelsAll.astype(int))
+'''
+    The function labels every foreground point of the depth frames with the
+    joint of its nearest bone segment, where every bone is split between its
+    two joints at its relativeWeights point and the torso outline belongs to
+    TORSO. depth_world is M x 3, joints N x nJoints x 3 and frames the frame
+    of every point. zScale weighs the z distances.
+'''
+def labelPoints(depth_world, joints, frames=None, zScale=1.0):
+    scale = np.array([1, 1, zScale])
+    seg1, seg2, segLabels = bones.getSegments(addTorso(joints)*scale, \
+        skeleton+torsoSkel, boneWeights, boneLabels)
+    return segLabels[bones.nearestSegment(depth_world*scale, seg1, seg2, frames)]
 
 # zScale: how much we trust the z value. 1 indicates equal trust on x, y, z
 def knn(depth, joints, C, visualize=False, zScale=1.0):
-    pts_world, labels = joints2skeleton(joints)
-
-    pts_world[:, 2] *= zScale
-    classifier = KNeighborsClassifier(n_neighbors=nNeighbors)
-    classifier.fit(pts_world, labels)
-
     X = np.vstack((np.nonzero(depth)[1], np.nonzero(depth)[0]))
     X = np.vstack((X, depth[depth != 0]))
     X_world = pixel2world(X.T, C)
+    predicts = labelPoints(X_world, joints[np.newaxis], zScale=zScale)
     X_world[:, 2] *= zScale
-    predicts = classifier.predict(X_world)
 
     perPixelLabels = -np.ones(depth.shape)
     perPixelLabels[depth != 0] = predicts
@@ -237,6 +188,8 @@ def knn(depth, joints, C, visualize=False, zScale=1.0):
 
     skel = None
     if visualize is True:
+        pts_world, labels = joints2skeleton(joints)
+        pts_world[:, 2] *= zScale
         #foreground = visualizePts(world2pixel(pts_world, C), labels)
         #img[foreground != 0] = foreground[foreground != 0]
         skel = visualizePts(world2pixel(pts_world, C), labels)
@@ -259,10 +212,270 @@ def errCorrect(depth_world, predicts, joints):
 
     return correctedJoints
 
+def getPersonFiles(dataDir, i):
+    person = dataDir+str(i).zfill(2)+'_'+'[0-9]'*5+'_'
+    files = [sorted(glob.glob(person + stream + '.txt')) \
+             for stream in archive.streams]
+    assert len(set([len(f) for f in files])) == 1
+    return zip(*files)
+
+def parseArray(path, dtype=float):
+    with open(path) as f:
+        return np.fromstring(f.read(), dtype=dtype, sep=' ')
+
+'''
+    The function returns the depth images, joints and labels of the side and
+    the top views of the frame of files (the paths of its archive.streams
+    text files). They are read from frameArchive (the index and the streams
+    of the archive of the person) when it holds the frame, and parsed from
+    the text files otherwise.
+'''
+def readFrame(files, frameArchive=None):
+    if frameArchive is not None:
+        index, arrays = frameArchive
+        row = archive.findFrames(index, [getFrameNumber(files[0])])[0]
+        if row != -1:
+            return [np.array(arrays[stream][row], \
+                             int if stream.startswith('label') else float) \
+                    for stream in archive.streams]
+
+    return [parseArray(files[0]).reshape((H, W)), \
+            parseArray(files[1]).reshape((H, W)), \
+            np.loadtxt(files[2], dtype=float, delimiter=', '), \
+            np.loadtxt(files[3], dtype=float, delimiter=', '), \
+            parseArray(files[4], int).reshape((H, W)), \
+            parseArray(files[5], int).reshape((H, W))]
+
+'''
+    The function labels the foreground of the depth image of one view with
+    the skeleton of joints (nJoints x 3, world), corrects the joints to the
+    centroids of their labels as in --test and labels the foreground again.
+    It returns the corrected joints as nJoints x 5 (pixel x, pixel y, depth,
+    world x, world y) and the H x W labels (-1 for the background).
+'''
+def annotateView(depth, joints, C):
+    X = np.vstack((np.nonzero(depth)[1], np.nonzero(depth)[0]))
+    X = np.vstack((X, depth[depth != 0]))
+    X_world = pixel2world(X.T, C)
+    joints_world = errCorrect(X_world, labelPoints(X_world, \
+                              joints[np.newaxis]), joints)
+    predicts = labelPoints(X_world, joints_world[np.newaxis])
+
+    X_pixel = world2pixel(X_world, C).astype(int)
+    perPixelLabels = -np.ones((H, W))
+    perPixelLabels[X_pixel[:, 1], X_pixel[:, 0]] = predicts
+
+    return (np.hstack((world2pixel(joints_world, C), joints_world[:, :2])), \
+            perPixelLabels)
+
+'''
+    The function annotates both views of the frame of files (the depth,
+    joints and label files of the side and the top views). It returns None
+    for a bad frame: one without side joints or with an empty user mask.
+'''
+def annotateFrame(files, C, frameArchive=None):
+    depthSide, depthTop, jointsSide, jointsTop, labelSide, labelTop = \
+        readFrame(files, frameArchive)
+
+    if np.count_nonzero(jointsSide) == 0:
+        return None
+    bin = np.bincount(labelSide.ravel())
+    if bin.shape[0] == 1:
+        return None
+    mostFreqLabel = np.argmax(bin[1:])+1
+    depthSide[labelSide != mostFreqLabel] = 0
+    depthTop[labelTop == -1] = 0
+    if np.count_nonzero(depthSide) == 0 or np.count_nonzero(depthTop) == 0:
+        return None
+
+    return (annotateView(depthSide, jointsSide[:, :3], C), \
+            annotateView(depthTop, jointsTop[:, :3], C))
+
+'''
+    The function annotates a chunk of the frames of one person and writes
+    them to the rows from start of the output files of the person. A frame
+    that is not valid (or turns out bad) gets zero joints and -1 labels
+    without being read.
+'''
+def annotateChunk(args):
+    files, valid, outFileName, start, C, archiveDir, person = args
+    frameArchive = None if archiveDir is None \
+        else archive.loadArchive(archiveDir, person)
+    out = [np.load(outFileName+suffix+'.npy', mmap_mode='r+') for suffix in \
+           ['_joints_side', '_joints_top', '_predicts_side', '_predicts_top']]
+
+    for k, frameFiles in enumerate(files):
+        frame = annotateFrame(frameFiles, C, frameArchive) if valid[k] else None
+        if frame is None:
+            frame = ((np.zeros((nJoints, 5)), -np.ones((H, W))),)*2
+        (out[0][start+k], out[2][start+k]), \
+            (out[1][start+k], out[3][start+k]) = frame
+
+    for arr in out:
+        arr.flush()
+    return len(files)
+
+def getFrameNumber(path):
+    return int(os.path.basename(path).split('_')[1])
+
+def getQualityPath(dataDir, i):
+    return dataDir+str(i).zfill(2)+'_quality.npy'
+
+'''
+    The function returns the quality of the frame of files as a tuple of
+    qualityFields: its frame number, whether it is valid (it has side
+    joints, a user label in the side view and foreground in both masked
+    views), the numbers of side and top joints that are not all zero, the
+    most frequent user label of the side view (0 for none), the foreground
+    pixel counts of the masked side and top views, C from its side joints
+    (0 without them) and the stamps of its files (see getFrameStamp).
+'''
+def getFrameQuality(files, frameArchive=None):
+    depthSide, depthTop, jointsSide, jointsTop, labelSide, labelTop = \
+        readFrame(files, frameArchive)
+
+    nJointsSide = np.count_nonzero(np.any(jointsSide != 0, axis=1))
+    nJointsTop = np.count_nonzero(np.any(jointsTop != 0, axis=1))
+    bin = np.bincount(labelSide.ravel())
+    label = np.argmax(bin[1:])+1 if bin.shape[0] > 1 else 0
+    fgSide = np.count_nonzero(depthSide[labelSide == label]) if label > 0 else 0
+    fgTop = np.count_nonzero(depthTop[labelTop != -1])
+    C = getC(jointsSide) if nJointsSide > 0 else 0
+
+    return (getFrameNumber(files[0]), \
+            nJointsSide > 0 and fgSide > 0 and fgTop > 0, nJointsSide, \
+            nJointsTop, label, fgSide, fgTop, C) + getFrameStamp(files)
+
+# the total size and the latest modification time of the files of a frame
+def getFrameStamp(files):
+    return (sum([os.path.getsize(path) for path in files]), \
+            max([os.path.getmtime(path) for path in files]))
+
+def getChunkQuality(args):
+    person, rows, files, archiveDir = args
+    frameArchive = None if archiveDir is None \
+        else archive.loadArchive(archiveDir, person)
+    return (person, rows, [getFrameQuality(frameFiles, frameArchive) \
+                           for frameFiles in files])
+
+'''
+    The function returns the quality indices of the people ids, a dict from
+    the person to a structured array of qualityFields with a row per frame
+    of getPersonFiles. The index of every person is saved next to the data
+    as <person>_quality.npy, and only the frames that are not in the saved
+    index, or whose files have other stamps than the saved ones, are read,
+    in a pool of nWorkers processes, chunk frames per task.
+'''
+def getQuality(dataDir, ids, nWorkers=cpu_count(), chunk=50, archiveDir=None):
+    quality, tasks = {}, []
+    for i in ids:
+        files = getPersonFiles(dataDir, i)
+        frames = np.array([getFrameNumber(f[0]) for f in files], int)
+        stamps = np.array([getFrameStamp(f) for f in files], \
+                          float).reshape(-1, 2)
+        old = np.load(getQualityPath(dataDir, i)) \
+            if os.path.isfile(getQualityPath(dataDir, i)) \
+            else np.zeros(0, qualityFields)
+        if old.dtype != np.dtype(qualityFields):
+            old = np.zeros(0, qualityFields) # saved without the stamps
+        rows = archive.findFrames(old['frame'], frames)
+
+        # the frames whose files changed since they were indexed
+        known = np.flatnonzero(rows != -1)
+        rows[known[(old['size'][rows[known]] != stamps[known, 0]) | \
+                   (old['mtime'][rows[known]] != stamps[known, 1])]] = -1
+
+        quality[i] = np.zeros(frames.shape[0], qualityFields)
+        quality[i][rows != -1] = old[rows[rows != -1]]
+        missing = np.flatnonzero(rows == -1)
+        tasks += [(i, missing[k:k+chunk], [files[m] for m in \
+                   missing[k:k+chunk]], archiveDir) \
+                  for k in range(0, missing.shape[0], chunk)]
+
+    pool = Pool(nWorkers)
+    for i, rows, q in pool.imap_unordered(getChunkQuality, tasks):
+        quality[i][rows] = np.array(q, qualityFields)
+    pool.close()
+    pool.join()
+
+    for i in ids:
+        if quality[i].shape[0] > 0:
+            np.save(getQualityPath(dataDir, i), quality[i])
+        print 'person id: %d; #frames: %d; #valid: %d' % \
+            (i, quality[i].shape[0], np.count_nonzero(quality[i]['valid']))
+    return quality
+
+'''
+    The function deletes the files of the frames of the people ids that
+    their quality indices mark invalid, and drops them from the indices.
+'''
+def deleteBad(dataDir, ids, quality):
+    for i in ids:
+        for frameFiles, q in zip(getPersonFiles(dataDir, i), quality[i]):
+            if not q['valid']:
+                print 'deleting bad frame %d of person %d' % (q['frame'], i)
+                for path in frameFiles:
+                    os.remove(path)
+        quality[i] = quality[i][quality[i]['valid']]
+        np.save(getQualityPath(dataDir, i), quality[i])
+
+# C from the side joints of the first frame that has them
+def getFirstC(ids, quality):
+    for i in ids:
+        rows = np.flatnonzero(quality[i]['jointsSide'] > 0)
+        if rows.shape[0] > 0:
+            return quality[i]['C'][rows[0]]
+    return 0
+
+'''
+    The function is the --out mode without any display. It annotates the
+    frames of the people ids in a pool of nWorkers processes, chunk frames
+    per task, and every task writes its frames straight to the memory
+    mapped output files of its person. The output files keep a row for
+    every frame, like the depth arrays of the frames, and the frames their
+    quality indices mark invalid get zero joints and -1 labels. The frame
+    numbers of the rows are saved to <person>_frames.npy. People without
+    frames get no output files. The frames are read from the archives in
+    archiveDir when it is given.
+'''
+def annotate(dataDir, outDir, ids, quality, nWorkers=cpu_count(), chunk=50, \
+             archiveDir=None):
+    people = [getPersonFiles(dataDir, i) for i in ids]
+    C = getFirstC(ids, quality)
+    print 'C = %.20f' % C
+
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+    tasks = []
+    for i, files in zip(ids, people):
+        N = len(files)
+        if N == 0:
+            continue
+        print 'person id: %d; #frames: %d; #valid: %d' % \
+            (i, N, np.count_nonzero(quality[i]['valid']))
+        outFileName = outDir + str(i).zfill(2)
+        np.save(outFileName+'_frames.npy', quality[i]['frame'])
+        for suffix, shape in [('_joints_side', (N, nJoints, 5)), \
+                              ('_joints_top', (N, nJoints, 5)), \
+                              ('_predicts_side', (N, H, W)), \
+                              ('_predicts_top', (N, H, W))]:
+            np.lib.format.open_memmap(outFileName+suffix+'.npy', mode='w+', \
+                                      dtype=float, shape=shape)
+        tasks += [(files[j:j+chunk], quality[i]['valid'][j:j+chunk], \
+                   outFileName, j, C, archiveDir, i) \
+                  for j in range(0, N, chunk)]
+
+    nFrames = sum([len(files) for files in people])
+    done = 0
+    pool = Pool(nWorkers)
+    for n in pool.imap_unordered(annotateChunk, tasks):
+        done += n
+        print 'annotated %d/%d frames' % (done, nFrames)
+    pool.close()
+    pool.join()
+
 def main(**kwargs):
-    C = 0
     bad = False
-    deleleBad = True
     dataDir = kwargs.get('indir')
     id = kwargs.get('id')
     startFrame = kwargs.get('start')
@@ -276,12 +489,21 @@ def main(**kwargs):
     if outDir[-1] != '/':
         outDir = outDir+'/'    
 
-    key = 0
+    ids = range(0 if id == -1 else id, nPeople if id == -1 else id+1)
+    quality = getQuality(dataDir, ids, kwargs.get('nworkers'), \
+                         kwargs.get('chunk'), kwargs.get('archive'))
+    if kwargs.get('delete'):
+        deleteBad(dataDir, ids, quality)
+        return
     if out:
-        startFrame = -1
-        testMode = True
+        annotate(dataDir, outDir, ids, quality, kwargs.get('nworkers'), \
+                 kwargs.get('chunk'), kwargs.get('archive'))
+        return
 
-    for i in range(0 if id == -1 else id, nPeople if id == -1 else id+1):
+    C = getFirstC(ids, quality)
+    print 'C = %.20f' % C
+    key = 0
+    for i in ids:
         person = dataDir+str(i).zfill(2)+'_'+'[0-9]'*5+'_'
         depthSideFiles = sorted(glob.glob(person + 'depth_side.txt'))
         depthTopFiles = sorted(glob.glob(person + 'depth_top.txt'))
@@ -294,17 +516,8 @@ def main(**kwargs):
             == len(jointsTopFiles) == len(labelSideFiles) == len(labelTopFiles)
         N = len(depthSideFiles)
         print 'person id: %d; #frames: %d' % (i, N)
-
-        jointsSide_all = None
-        jointsTop_all = None
-        predictsSide_all = None
-        predictsTop_all = None
-
-        if out:
-            jointsSide_all = np.zeros((N, nJoints, 5))
-            jointsTop_all = np.zeros((N, nJoints, 5))
-            predictsSide_all = -np.ones((N, H, W))
-            predictsTop_all = -np.ones((N, H, W))
+        frameArchive = None if kwargs.get('archive') is None \
+            else archive.loadArchive(kwargs.get('archive'), i)
 
         j = 0
         while j < N:
@@ -324,89 +537,50 @@ def main(**kwargs):
                     j += 1
                     continue
 
-            depthSide = np.loadtxt(depthSideFiles[j], dtype=float).reshape((H, W))
-            depthTop = np.loadtxt(depthTopFiles[j], dtype=float).reshape((H, W))
-            jointsSide = np.loadtxt(jointsSideFiles[j], dtype=float, delimiter=', ')
-            jointsTop = np.loadtxt(jointsTopFiles[j], dtype=float, delimiter=', ')
-            labelSide = np.loadtxt(labelSideFiles[j], dtype=int).reshape((H, W))
-            labelTop = np.loadtxt(labelTopFiles[j], dtype=int).reshape((H, W))
-
-            if np.count_nonzero(jointsSide) == 0 and \
-                np.count_nonzero(jointsSide) == 0:
-                bad = True
-                if deleleBad:
-                    print 'automatically delete bad frame %d' % curFrame
-                    os.remove(depthSideFiles[j])
-                    os.remove(depthTopFiles[j])
-                    os.remove(jointsSideFiles[j])
-                    os.remove(jointsTopFiles[j])
-                    os.remove(labelSideFiles[j])
-                    os.remove(labelTopFiles[j])
-                    continue
-            else:
-                bad = False
+            if not quality[i]['valid'][j]:
+                print 'skipping bad frame: %d' % curFrame
+                if key == 65361 and j > 0:
+                    j -= 1
+                else:
+                    key = 0
+                    j += 1
+                continue
 
-            if C == 0 and (not bad):
-                C = getC(jointsSide)
-                print 'C = %.20f' % C
+            depthSide, depthTop, jointsSide, jointsTop, labelSide, labelTop = \
+                readFrame([depthSideFiles[j], depthTopFiles[j], \
+                           jointsSideFiles[j], jointsTopFiles[j], \
+                           labelSideFiles[j], labelTopFiles[j]], frameArchive)
 
             # make and apply masks
-            bin = np.bincount(labelSide.ravel())
-            if bin.shape[0] == 1:
-                bad = True
-                if deleleBad:
-                    print 'automatically delete bad frame %d' % curFrame
-                    os.remove(depthSideFiles[j])
-                    os.remove(depthTopFiles[j])
-                    os.remove(jointsSideFiles[j])
-                    os.remove(jointsTopFiles[j])
-                    os.remove(labelSideFiles[j])
-                    os.remove(labelTopFiles[j])
-                    continue
-            mostFreqLabel = np.argmax(bin[1:])+1
+            mostFreqLabel = quality[i]['label'][j]
             labelSide[labelSide != mostFreqLabel] = 0
             labelSide[labelSide == mostFreqLabel] = 1
             labelTop[labelTop != -1] = 1
             labelTop[labelTop == -1] = 0
             depthSide *= labelSide
             depthTop *= labelTop
-            if np.nonzero(depthSide)[0].shape[0] == 0 or \
-                np.nonzero(depthTop)[0].shape[0] == 0:
-                bad = True
-                if deleleBad:
-                    print 'automatically delete bad frame %d' % curFrame
-                    os.remove(depthSideFiles[j])
-                    os.remove(depthTopFiles[j])
-                    os.remove(jointsSideFiles[j])
-                    os.remove(jointsTopFiles[j])
-                    os.remove(labelSideFiles[j])
-                    os.remove(labelTopFiles[j])
-                    continue
 
             dispSide = cv2.equalizeHist(depthSide.astype(np.uint8))
             dispSide = cv2.applyColorMap(dispSide, cv2.COLORMAP_SPRING)
             dispSide = np.multiply(dispSide, labelSide[:, :, np.newaxis])
             dispSideWithJoints = drawJoints(dispSide, jointsSide[:, 3:], bad)
             dispSideWithJoints = drawID(dispSideWithJoints, curFrame)
-            if not out:
-                cv2.imshow('depthSide', dispSideWithJoints)
+            cv2.imshow('depthSide', dispSideWithJoints)
 
             dispTop = cv2.equalizeHist(depthTop.astype(np.uint8))
             dispTop = cv2.applyColorMap(dispTop, cv2.COLORMAP_SPRING)
             dispTop = np.multiply(dispTop, labelTop[:, :, np.newaxis])
             dispTopWithJoints = drawJoints(dispTop, jointsTop[:, 3:], bad)
             dispTopWithJoints = drawID(dispTopWithJoints, curFrame)
-            if not out:
-                cv2.imshow('depthTop', dispTopWithJoints)
+            cv2.imshow('depthTop', dispTopWithJoints)
 
             # knn
             perPixelSide, depthSide_world, predictsSide, _ = knn(depthSide, \
                 jointsSide[:, :3], C)
             perPixelTop, depthTop_world, predictsTop, _ = knn(depthTop, \
                 jointsTop[:, :3], C)
-            if not out:
-                cv2.imshow('perPixelSide', perPixelSide)
-                cv2.imshow('perPixelTop', perPixelTop)
+            cv2.imshow('perPixelSide', perPixelSide)
+            cv2.imshow('perPixelTop', perPixelTop)
 
             jointsSide_world, jointsTop_world = None, None
             # error correction
@@ -420,9 +594,8 @@ def main(**kwargs):
                     world2pixel(jointsSide_world, C)[:, :2], bad)
                 dispTopWithJoints = drawJoints(dispTop, \
                     world2pixel(jointsTop_world, C)[:, :2], bad)
-                if not out:
-                    cv2.imshow('correctedDepthSide', dispSideWithJoints)
-                    cv2.imshow('correctedDepthTop', dispTopWithJoints)
+                cv2.imshow('correctedDepthSide', dispSideWithJoints)
+                cv2.imshow('correctedDepthTop', dispTopWithJoints)
 
                 perPixelSide, depthSide_world, predictsSide, _ = \
                     knn(depthSide, jointsSide_world, C)
@@ -431,62 +604,28 @@ def main(**kwargs):
 
                 #print tmp1.shape, tmp2.shape, tmp3.shape, tmp4.shape
 
-                if not out:
-                    cv2.imshow('correctedPerPixelSide', perPixelSide)
-                    cv2.imshow('correctedPerPixelTop', perPixelTop)
-
-            if not out:
-                key = cv2.waitKey(0)
-                if key == ord('s'):
-                    return
-                elif key == 65288:
-                    print 'deleting frame %d' % curFrame
-                    os.remove(depthSideFiles[j])
-                    os.remove(depthTopFiles[j])
-                    os.remove(jointsSideFiles[j])
-                    os.remove(jointsTopFiles[j])
-                    os.remove(labelSideFiles[j])
-                    os.remove(labelTopFiles[j])
-                elif key == 65361:
-                    j -= 2
-            else:
-                # need joints and labels
-                depthSide_pixel = world2pixel(depthSide_world, C)
-                depthTop_pixel = world2pixel(depthTop_world, C)
-                jointsSide_pixel = world2pixel(jointsSide_world, C)
-                jointsTop_pixel = world2pixel(jointsTop_world, C)
-
-                for m in range(predictsSide.shape[0]):
-                    predictsSide_all[j, depthSide_pixel[m][1], \
-                        depthSide_pixel[m][0]] = predictsSide[m]
-
-                for m in range(predictsTop.shape[0]):
-                    predictsTop_all[j, depthTop_pixel[m][1], \
-                        depthTop_pixel[m][0]] = predictsTop[m]
-
-                jointsSide_all[j] = np.hstack((jointsSide_pixel, \
-                                              jointsSide_world[:, :2]))
-                jointsTop_all[j] = np.hstack((jointsTop_pixel, \
-                                             jointsTop_world[:, :2]))
+                cv2.imshow('correctedPerPixelSide', perPixelSide)
+                cv2.imshow('correctedPerPixelTop', perPixelTop)
+
+            key = cv2.waitKey(0)
+            if key == ord('s'):
+                return
+            elif key == 65288:
+                print 'deleting frame %d' % curFrame
+                os.remove(depthSideFiles[j])
+                os.remove(depthTopFiles[j])
+                os.remove(jointsSideFiles[j])
+                os.remove(jointsTopFiles[j])
+                os.remove(labelSideFiles[j])
+                os.remove(labelTopFiles[j])
+            elif key == 65361:
+                j -= 2
 
             j += 1
 
             #print depthSide.shape, depthTop.shape, jointsSide.shape, \
             #jointsTop.shape, labelSide.shape, labelTop.shape
 
-        if out:
-            print 'saving files...'
-            if not os.path.exists(outDir):
-                os.makedirs(outDir)
-            outFileName = outDir + str(id).zfill(2)
-            print 'file prefix: %s' % outFileName
-
-            np.save(outFileName+'_joints_side', jointsSide_all)
-            np.save(outFileName+'_joints_top', jointsTop_all)
-            np.save(outFileName+'_predicts_side', predictsSide_all)
-            np.save(outFileName+'_predicts_top', predictsTop_all)
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--indir', required=True)
@@ -495,5 +634,9 @@ if __name__ == '__main__':
     parser.add_argument('--test', action='store_true')
     parser.add_argument('--out', action='store_true')
     parser.add_argument('--outdir', default='')
+    parser.add_argument('--nworkers', type=int, default=cpu_count())
+    parser.add_argument('--chunk', type=int, default=50)
+    parser.add_argument('--archive')
+    parser.add_argument('--delete', action='store_true')
     args = parser.parse_args()
     main(**vars(args))
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import proc
+import archive
+
+'''
+    The function writes the text files of a frame of person 0 in dataDir, in
+    the format of the ITOP dumps: a user (label 1) in a block of the side
+    view, the same block in the top view and the side joints only when
+    valid is True.
+'''
+def writeFrame(dataDir, frame, valid, rng):
+    depth = rng.uniform(1, 4, (proc.H, proc.W))
+    joints = np.column_stack((rng.uniform(-500, 500, (proc.nJoints, 2)), \
+        rng.uniform(1000, 3000, proc.nJoints), \
+        rng.uniform(0, proc.W, proc.nJoints), \
+        rng.uniform(0, proc.H, proc.nJoints)))
+    labelSide = np.zeros((proc.H, proc.W), int)
+    labelSide[50:100, 60:90] = 1
+    labelTop = -np.ones((proc.H, proc.W), int)
+    labelTop[50:100, 60:90] = 0
+
+    arrays = [depth, depth, joints if valid else 0*joints, joints, \
+              labelSide, labelTop]
+    for stream, arr in zip(archive.streams, arrays):
+        path = '%s00_%05d_%s.txt' % (dataDir, frame, stream)
+        if stream.startswith('joints'):
+            np.savetxt(path, arr, fmt='%f', delimiter=', ')
+        else:
+            np.savetxt(path, arr, fmt='%d' if stream.startswith('label') \
+                       else '%f')
+
+class QualityTest(unittest.TestCase):
+    def setUp(self):
+        self.dataDir = tempfile.mkdtemp()+'/'
+        self.rng = np.random.RandomState(0)
+        for frame, valid in zip([0, 1, 2], [True, False, True]):
+            writeFrame(self.dataDir, frame, valid, self.rng)
+
+    def tearDown(self):
+        shutil.rmtree(self.dataDir)
+
+    def getQuality(self, archiveDir=None):
+        return proc.getQuality(self.dataDir, [0], 1, 2, archiveDir)[0]
+
+    def testQuality(self):
+        quality = self.getQuality()
+        np.testing.assert_array_equal(quality['frame'], [0, 1, 2])
+        np.testing.assert_array_equal(quality['valid'], [True, False, True])
+        np.testing.assert_array_equal(quality['jointsSide'], \
+                                      [proc.nJoints, 0, proc.nJoints])
+        np.testing.assert_array_equal(quality['label'], [1, 1, 1])
+        np.testing.assert_array_equal(quality['fgSide'], [1500]*3)
+        np.testing.assert_array_equal(quality['fgTop'], [1500]*3)
+        self.assertEqual(quality['C'][1], 0)
+        self.assertEqual(proc.getFirstC([0], {0: quality}), quality['C'][0])
+
+    def testSavedRowsReused(self):
+        quality = self.getQuality()
+        quality['C'] = 123
+        np.save(proc.getQualityPath(self.dataDir, 0), quality)
+        np.testing.assert_array_equal(self.getQuality()['C'], [123]*3)
+
+    def testChangedFramesRead(self):
+        quality = self.getQuality()
+        quality['C'] = 123
+        np.save(proc.getQualityPath(self.dataDir, 0), quality)
+
+        writeFrame(self.dataDir, 1, True, self.rng)
+        for path in proc.getPersonFiles(self.dataDir, 0)[1]:
+            os.utime(path, (0, os.path.getmtime(path)+10))
+        quality = self.getQuality()
+        np.testing.assert_array_equal(quality['valid'], [True]*3)
+        np.testing.assert_array_equal(quality['C'] == 123, \
+                                      [True, False, True])
+
+    def testNewFrames(self):
+        self.getQuality()
+        writeFrame(self.dataDir, 5, False, self.rng)
+        quality = self.getQuality()
+        np.testing.assert_array_equal(quality['frame'], [0, 1, 2, 5])
+        np.testing.assert_array_equal(quality['valid'], \
+                                      [True, False, True, False])
+
+    def testArchive(self):
+        archiveDir = tempfile.mkdtemp()
+        try:
+            archive.convertPerson((self.dataDir[:-1], archiveDir, 0))
+            frameArchive = archive.loadArchive(archiveDir, 0)
+            for files in proc.getPersonFiles(self.dataDir, 0):
+                for a, b in zip(proc.readFrame(files), \
+                                proc.readFrame(files, frameArchive)):
+                    np.testing.assert_array_equal(a, b)
+
+            expected = self.getQuality()
+            os.remove(proc.getQualityPath(self.dataDir, 0))
+            quality = self.getQuality(archiveDir)
+            for name, _ in proc.qualityFields:
+                np.testing.assert_array_equal(quality[name], expected[name])
+        finally:
+            shutil.rmtree(archiveDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn import tree
-from sklearn.externals import joblib
 from multiprocessing import Process as worker
 from get_acc_joints import *
 import util
 import os
+import sys
 import glob
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                             '..', '..', 'RTW'))
+import modelfile
 
 # parameters
 num_joints = 15
@@ -45,33 +48,77 @@ def train_rf(i, root_dir):
   rf = RandomForestClassifier(n_estimators=3, criterion='entropy', max_depth=20)
   rf.fit(train_data['features'], train_data['labels'])
 
-  joblib.dump(rf, root_dir + 'models/rf_' + str(i).zfill(2) + '.pkl')
-  print root_dir + 'models/rf_' + str(i).zfill(2) + '.pkl saved'
+  save_forest(root_dir + 'models/rf_' + str(i).zfill(2) + '.model', rf)
+  print root_dir + 'models/rf_' + str(i).zfill(2) + '.model saved'
+
+# packs the trees of a forest into one model file: node arrays plus the
+# class probabilities of every node in half precision
+def save_forest(path, rf):
+  arrays = {}
+  for t, estimator in enumerate(rf.estimators_):
+    tree_ = estimator.tree_
+    value = tree_.value[:, 0, :]
+    arrays['tree%d_feature' % t] = np.maximum(tree_.feature, 0).astype(np.int32)
+    arrays['tree%d_threshold' % t] = tree_.threshold.astype(np.float64)
+    arrays['tree%d_left' % t] = tree_.children_left.astype(np.int32)
+    arrays['tree%d_right' % t] = tree_.children_right.astype(np.int32)
+    arrays['tree%d_proba' % t] = (value / value.sum(axis=1)[:, np.newaxis]).astype(np.float16)
+  manifest = {'model': 'forest', 'n_trees': len(rf.estimators_),
+              'classes': rf.classes_.tolist(),
+              'n_features': int(rf.n_features_)}
+  modelfile.saveArrays(path, arrays, manifest)
+
+def load_forest(path):
+  arrays, manifest = modelfile.loadArrays(path)
+  trees = [(arrays['tree%d_feature' % t], arrays['tree%d_threshold' % t],
+            arrays['tree%d_left' % t], arrays['tree%d_right' % t],
+            arrays['tree%d_proba' % t]) for t in range(manifest['n_trees'])]
+  return {'trees': trees, 'classes': np.array(manifest['classes'])}
+
+# same output as RandomForestClassifier.predict_proba, walking every tree
+# one level at a time for all the rows of X
+def predict_proba_forest(forest, X):
+  X = np.asarray(X, dtype=np.float32)
+  proba = np.zeros((X.shape[0], forest['classes'].shape[0]))
+  for feature, threshold, left, right, tree_proba in forest['trees']:
+    nodes = np.zeros(X.shape[0], dtype=np.int32)
+    active = np.flatnonzero(left[nodes] != -1)
+    while active.shape[0] > 0:
+      nd = nodes[active]
+      nd = np.where(X[active, feature[nd]] <= threshold[nd], left[nd], right[nd])
+      nodes[active] = nd
+      active = active[left[nd] != -1]
+    proba += tree_proba[nodes]
+  return proba / len(forest['trees'])
 
 def test_rf(root_dir, test_range, train_range):
+  # the forests are opened once and shared by all the test people
+  forests = []
+  for j in train_range:
+    forests.append(load_forest(root_dir + 'models/rf_' + str(j).zfill(2) + '.model'))
+    print 'Model loaded for', root_dir + 'models/rf_' + str(j).zfill(2) + '.model'
+
   # processes = []
   for i in test_range:
-      test_rf_batch(i, train_range, root_dir)
+      test_rf_batch(i, forests, root_dir)
   #   processes.append(
   #     worker(
   #       target=test_rf_batch,
   #       name="Thread #%d" % i,
-  #       args=(i, train_range, root_dir)
+  #       args=(i, forests, root_dir)
   #     )
   #   )
   # [t.start() for t in processes]
   # [t.join() for t in processes]
 
-def test_rf_batch(i, train_range, root_dir):
+def test_rf_batch(i, forests, root_dir):
   data_dir = root_dir + 'person_' + str(i).zfill(2) + '/'
   test_data = get_data_ensemble(data_dir, test_batch)
   print 'Loading test batch from', data_dir
 
   pred_prob_ensemble = np.zeros((len(test_data['labels']), num_joints))
-  for j in train_range:
-    rf = joblib.load(root_dir + 'models/rf_' + str(j).zfill(2) + '.pkl')
-    print 'Model loaded for', root_dir + 'models/rf_' + str(j).zfill(2) + '.pkl'
-    pred_prob_ensemble += rf.predict_proba(test_data['features'])
+  for forest in forests:
+    pred_prob_ensemble += predict_proba_forest(forest, test_data['features'])
 
   pred_label = np.argmax(pred_prob_ensemble, axis=1)
   np.save(data_dir+'pred_prob.npy', pred_prob_ensemble)
@@ -5,6 +5,10 @@ import os
 from sklearn.metrics import confusion_matrix
 from multiprocessing import Process as worker
 from get_acc_joints import *
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                             '..', '..', 'RTW'))
+import archive
 
 X_path = 'X.npy'
 images_path = 'images.npy'
@@ -12,7 +16,9 @@ labels_path = 'labels.npy'
 width = 320
 height = 240
 
-def load_data_new(file_list, person_id, npy_root):
+# archive_dir: the frames the archive of the person holds (see RTW/archive.py)
+# are read from it instead of being parsed from file_list
+def load_data_new(file_list, person_id, npy_root, archive_dir=None):
   depth_top, depth_side = [], []
   # label_top, label_side = [], []
   # joint_top, joint_side = [], []
@@ -26,9 +32,19 @@ def load_data_new(file_list, person_id, npy_root):
 
   num_data = len(depth_top_files)
 
+  rows = -np.ones(num_data, int)
+  if archive_dir is not None:
+    index, arrays = archive.loadArchive(archive_dir, int(person_id))
+    rows = archive.findFrames(index, [int(os.path.basename(f).split('_')[1]) \
+                                      for f in depth_top_files])
+
   for i in range(num_data):
     if i % 100 == 0:
       print 'Thread', person_id, 'Processed', i, '/', num_data
+    if rows[i] != -1:
+      depth_top.append(np.array(arrays['depth_top'][rows[i]]))
+      depth_side.append(np.array(arrays['depth_side'][rows[i]]))
+      continue
     depth_top.append(np.loadtxt(depth_top_files[i], delimiter='\n').reshape(height, width))
     depth_side.append(np.loadtxt(depth_side_files[i], delimiter='\n').reshape(height, width))
     # label_top.append(np.loadtxt(label_top_files[i], delimiter='\n').reshape(height, width))
@@ -258,7 +274,7 @@ def main():
     [t.start() for t in processes]
     [t.join() for t in processes]
 
-def main_1():
+def main_1(archive_dir=None):
   data_root = '/mnt0/data/ITOP/all/'
   npy_root = '/mnt0/data/ITOP/out/'
   data_files = listdir(data_root)
@@ -275,7 +291,7 @@ def main_1():
       worker(
         target=load_data_new,
         name="Thread #%d" % i,
-        args=(person_i, index, npy_root)
+        args=(person_i, index, npy_root, archive_dir)
       )
     )
   [t.start() for t in processes]